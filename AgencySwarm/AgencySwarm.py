@@ -2,28 +2,36 @@
 
 import sys
 import traceback
-import io                 # Added for capturing stdout
-import contextlib         # Added for redirecting stdout
+import json
+import queue
 import datetime # Added
 from datetime import timezone, timedelta # Added
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, url_for
 from flask_login import login_required, current_user
 import tiktoken
-from collections import OrderedDict # Import OrderedDict for LRU cache behaviour
 import threading # Import threading for Lock
 
 # Agency Swarm Imports
 from agency_swarm import Agency
+from agency_swarm.util.streaming import AgencyEventHandler
 
 # Import agent classes (adjust path if needed, assumes they are at the root)
 # If agents are moved into AgencySwarm folder, change imports
 from MonitorCEO.MonitorCEO import MonitorCEO
 from WebsiteMonitor.WebsiteMonitor import WebsiteMonitor
+from WebsiteMonitor.tools.step_events import emit_step, collect_steps
+
+# Per-conversation locking, shared state and threads (safe for concurrent conversations)
+from .tools.tools import (get_conversation_lock, route_tool_shared_state,
+                          route_agency_threads, clone_agency, get_agency_thread_ids, use_conversation)
+from .tools.agency_cache import AgencyCache, estimate_agency_bytes
+from .tools.chat_jobs import ChatJobQueue
+from .tools.token_usage import TurnUsage, TurnCostEstimate, collect_usage
 
 # Import database functions
 from Database.database_manager import (
-    get_user_token_details, update_token_usage, add_chat_message, reset_tokens,
-    create_conversation, check_conversation_owner, get_chat_history, delete_conversation # Add new imports
+    ChatUnitOfWork, check_conversation_owner, get_chat_history, delete_conversation,
+    get_conversation_threads, save_conversation_threads
 )
 
 # Define the Blueprint for API routes related to the agency
@@ -33,38 +41,72 @@ from Database.database_manager import (
 _api_bp = Blueprint('agency_api', __name__, url_prefix='/api')
 
 # --- Agency Setup ---
-# Global cache for agency instances per conversation_id (LRU Cache)
-# Keys: conversation_id, Values: Agency instance
-_agency_cache = OrderedDict()
-MAX_CACHE_SIZE = 50 # Max number of agency instances to keep in memory per worker
-_cache_lock = threading.Lock() # Add a lock for cache access and agent usage
-
-# Global variable for tokenizer encoding (can still be shared)
+# Template agency shared by all conversations: agents, assistants (synced against settings.json)
+# and tools are built once per process; each conversation gets a clone with its own threads.
+_template_agency = None
+_template_lock = threading.Lock()
+
+def _agency_size(agency):
+    """Approximate memory of one cached conversation (the template's agents are shared, not counted)."""
+    template = _template_agency
+    return estimate_agency_bytes(agency, shared=template.agents + [template.user] if template else ())
+
+# Per-conversation agencies (Keys: conversation_id). Limits come from AGENCY_CACHE_MAX_ENTRIES,
+# AGENCY_CACHE_IDLE_TTL_SECONDS and AGENCY_CACHE_MAX_MEMORY_MB; see AgencyCache.
+_agency_cache = AgencyCache(size_of=_agency_size)
+
+def get_agency_metrics():
+    """Returns the agency cache counters (hits, misses, evictions, build latency, size)."""
+    return _agency_cache.stats()
+
+# Global variable for tokenizer encoding (can still be shared).
+# Used to size token reservations and to estimate usage when the API did not report any (see _finish_chat_turn).
 _tokenizer_encoding = None
+_tokenizer_failed = False # Don't retry (tiktoken downloads its encoding) on every turn
 
 def get_tokenizer_encoding():
     """Initializes and returns the tiktoken encoding."""
-    global _tokenizer_encoding
-    if _tokenizer_encoding is None:
+    global _tokenizer_encoding, _tokenizer_failed
+    if _tokenizer_encoding is None and not _tokenizer_failed:
         try:
             # Use a common model for estimation. Change if you know the specific model used by agency-swarm.
             _tokenizer_encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
         except Exception as e:
             print(f"Error initializing tiktoken encoder: {e}", file=sys.stderr)
             _tokenizer_encoding = None # Ensure it's None if failed
+            _tokenizer_failed = True
     return _tokenizer_encoding
 
-# Renamed from create_agency - This now BUILDS a NEW instance every time it's called.
-def _build_new_agency(conversation_id):
-    """Builds and returns a NEW Agency Swarm Agency object for each call."""
-    print(f"Building NEW agency instance for conversation {conversation_id}...")
+# Tokens a turn uses beyond its message, learned from finished turns (see TurnCostEstimate)
+_turn_cost = None
+_turn_cost_lock = threading.Lock()
+
+def get_turn_cost_estimate():
+    """Returns the process-wide TurnCostEstimate, starting from TOKEN_RESERVATION_PER_TURN."""
+    global _turn_cost
+    if _turn_cost is None:
+        with _turn_cost_lock:
+            if _turn_cost is None:
+                _turn_cost = TurnCostEstimate(current_app.config.get('TOKEN_RESERVATION_PER_TURN', 2000))
+    return _turn_cost
+
+def estimate_tokens(text):
+    """Token count of text by tiktoken, or roughly 4 characters per token if tiktoken is unavailable."""
+    encoding = get_tokenizer_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def _build_template_agency():
+    """Builds the Agency Swarm Agency that conversations are cloned from."""
+    print("Building template agency...")
     try:
         monitor_ceo = MonitorCEO()
         monitor_worker = WebsiteMonitor()
+        route_tool_shared_state([monitor_ceo, monitor_worker]) # Before Agency(), so running conversations keep their state
         print("Agents initialized successfully.")
 
         print("Creating agency structure...")
-        # Create the new agency instance directly
         agency = Agency(
             agency_chart=[
                 monitor_ceo,
@@ -73,11 +115,9 @@ def _build_new_agency(conversation_id):
             # Check path relative to project root where app runs
             shared_instructions='agency_manifesto.md',
         )
-        print(f"Agency structure created successfully for conversation {conversation_id}.")
-        return agency # Return the newly created instance
 
     except FileNotFoundError:
-        print(f"Warning: agency_manifesto.md not found for conversation {conversation_id}. Creating without.", file=sys.stderr)
+        print("Warning: agency_manifesto.md not found. Creating template agency without.", file=sys.stderr)
         # Create without manifesto
         agency = Agency(
              agency_chart=[
@@ -85,169 +125,167 @@ def _build_new_agency(conversation_id):
                 [monitor_ceo, monitor_worker],
             ]
         )
-        print(f"Agency structure created (no manifesto) for conversation {conversation_id}.")
-        return agency # Return the newly created instance
 
-    except Exception as e:
-        print(f"Fatal Error initializing agents or agency structure: {e}", file=sys.stderr)
-        traceback.print_exc()
+    # Tools must see the shared state and threads of the conversation using them
+    route_tool_shared_state(agency.agents)
+    route_agency_threads(agency)
+    print("Template agency created successfully.")
+    return agency
+
+def get_template_agency():
+    """Returns the process-wide template agency, building it on first use (None if that fails)."""
+    global _template_agency
+    if _template_agency is None:
+        with _template_lock: # One build; Agency() also writes settings.json
+            if _template_agency is None:
+                try:
+                    _template_agency = _build_template_agency()
+                except Exception as e:
+                    print(f"Fatal Error initializing agents or agency structure: {e}", file=sys.stderr)
+                    traceback.print_exc()
+    return _template_agency
+
+def _build_new_agency(conversation_id):
+    """Returns a NEW per-conversation agency (a clone of the template), resuming the conversation's saved threads."""
+    template = get_template_agency()
+    if template is None:
         return None # Indicate failure
+    thread_ids = get_conversation_threads(conversation_id)
+    agency = clone_agency(template, thread_ids)
+    agency._saved_thread_ids = thread_ids # What the database holds, see save_agency_threads()
+    print(f"Created agency instance for conversation {conversation_id} ({'resumed saved threads' if thread_ids else 'new threads'}).")
+    return agency
+
+def save_agency_threads(conversation_id, agency):
+    """Saves the agency's thread IDs if they changed (threads are created during turns), so the
+    conversation survives cache eviction and worker restarts."""
+    thread_ids = get_agency_thread_ids(agency)
+    if thread_ids == getattr(agency, '_saved_thread_ids', None):
+        return
+    if save_conversation_threads(conversation_id, thread_ids):
+        agency._saved_thread_ids = thread_ids
+        print(f"Saved agency thread IDs for conversation {conversation_id}.")
 
 def get_or_create_agency(conversation_id):
-    """Gets an agency instance from cache or creates a new one (Thread-Safe)."""
-    global _agency_cache
-    with _cache_lock: # Acquire lock for reading/writing cache
-        if conversation_id in _agency_cache:
-            _agency_cache.move_to_end(conversation_id)
-            print(f"Reusing cached agency instance for conversation {conversation_id}.")
-            return _agency_cache[conversation_id]
-        else:
-            if len(_agency_cache) >= MAX_CACHE_SIZE:
-                oldest_convo_id, _ = _agency_cache.popitem(last=False)
-                print(f"Cache full. Evicted agency instance for conversation {oldest_convo_id}.")
-            # Build happens inside the lock to prevent multiple builds for the same new ID
-            new_agency = _build_new_agency(conversation_id)
-            if new_agency:
-                _agency_cache[conversation_id] = new_agency
-                print(f"Cached new agency instance for conversation {conversation_id}.")
-            return new_agency
+    """Gets an agency instance from cache or creates a new one (Thread-Safe, one build per conversation)."""
+    return _agency_cache.get_or_build(conversation_id, _build_new_agency)
 
 # --- API Endpoint(s) ---
 
-@_api_bp.route('/chat', methods=['POST'], endpoint='agency_chat')
-@login_required
-def chat_api():
-    user_id = current_user.id
-    token_details = get_user_token_details(user_id)
-    encoding = get_tokenizer_encoding()
-
-    if not encoding:
-         return jsonify({"error": "Token processing unavailable. Please try again later."}), 500
-    if not token_details:
-         print(f"Error: Could not retrieve token details for logged-in user {user_id}")
-         return jsonify({"error": "Could not verify user usage details."}), 500
-
-    # --- Check and Apply Token Reset --- 
-    if not token_details['is_subscribed']:
-        last_reset_time = token_details.get('last_token_reset')
-        reset_interval_minutes = current_app.config.get('TOKEN_RESET_INTERVAL_MINUTES', 5)
-        
-        # Ensure last_reset_time is timezone-aware (it should be if stored as TIMESTAMPTZ)
-        # If it's missing or None (e.g., old user row before column added), force reset
-        needs_reset = False
-        if last_reset_time:
-            now_utc = datetime.datetime.now(timezone.utc)
-            time_since_reset = now_utc - last_reset_time
-            if time_since_reset > timedelta(minutes=reset_interval_minutes):
-                needs_reset = True
-        else:
-            # No previous reset time found, trigger reset
-            needs_reset = True 
-            
-        if needs_reset:
-            print(f"User {user_id} token reset interval ({reset_interval_minutes} min) passed. Resetting tokens.")
-            reset_success = reset_tokens(user_id)
-            if reset_success:
-                # IMPORTANT: Re-fetch details after reset
-                print(f"Re-fetching token details for user {user_id} after reset.")
-                token_details = get_user_token_details(user_id)
-                if not token_details:
-                     print(f"Error: Could not re-fetch token details after reset for user {user_id}")
-                     # Fail safe? Or proceed assuming reset worked?
-                     # Let's return an error to be safe.
-                     return jsonify({"error": "Error applying token reset. Please try again."}), 500
-            else:
-                 print(f"Error: Failed to reset tokens for user {user_id}. Proceeding without reset.")
-                 # Decide how to handle - maybe proceed with old token count?
-                 # For now, we log the error and continue; the limit check below will use the old count.
-
-    # --- Token Limit Check --- 
-    token_limit = current_app.config.get('FREE_TIER_TOKEN_LIMIT', 200)
-    if not token_details['is_subscribed']:
-        if token_details['tokens_used'] >= token_limit:
-            print(f"User {user_id} reached token limit ({token_details['tokens_used']} >= {token_limit})")
-            
-            # --- Calculate Time Remaining --- 
-            time_remaining_str = "soon" # Default message
-            next_reset_timestamp_iso = None
-            reset_interval_minutes = current_app.config.get('TOKEN_RESET_INTERVAL_MINUTES', 5)
-            last_reset_time = token_details.get('last_token_reset')
-
-            if last_reset_time:
-                # Ensure last_reset_time is offset-aware UTC
-                if last_reset_time.tzinfo is None:
-                     # If somehow it's naive, assume UTC (though TIMESTAMPTZ should prevent this)
-                     last_reset_time = last_reset_time.replace(tzinfo=timezone.utc)
-                
-                next_reset_time = last_reset_time + timedelta(minutes=reset_interval_minutes)
-                now_utc = datetime.datetime.now(timezone.utc)
-                time_remaining = next_reset_time - now_utc
-                next_reset_timestamp_iso = next_reset_time.isoformat()
-
-                if time_remaining.total_seconds() > 0:
-                    total_seconds = int(time_remaining.total_seconds())
-                    minutes = total_seconds // 60
-                    seconds = total_seconds % 60
-                    if minutes > 0:
-                        time_remaining_str = f"in approximately {minutes} minute(s) and {seconds} second(s)"
-                    else:
-                        time_remaining_str = f"in approximately {seconds} second(s)"
-                else:
-                    time_remaining_str = "very shortly (on your next request)"
-            else:
-                # Should ideally not happen if column has default, but handle anyway
-                time_remaining_str = "on your next request"
-
-            limit_message = f"You have reached your free token limit of {token_limit}. Your tokens will reset {time_remaining_str}."
-            
-            return jsonify({
-                "limit_reached": True,
-                "message": limit_message,
-                "next_reset_at": next_reset_timestamp_iso # Optional: send timestamp for potential frontend timer
-            }), 403
+def _begin_chat_turn(user_id):
+    """Checks the request and the user's token quota, resolves (or creates) the conversation,
+    logs the user message and gets the conversation's agency. The database work is one
+    unit of work (one connection, one transaction).
 
+    Returns (turn, None) with turn a dict (user_id, token_details, message, conversation_id,
+    is_new_conversation, agency), or (None, (json_response, status_code)).
+    """
     # --- Get Request Data ---
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return None, (jsonify({"error": "Request must be JSON"}), 400)
 
     data = request.get_json()
     message = data.get('message')
     conversation_id = data.get('conversation_id') # Get conversation_id from request
 
     if not message:
-        return jsonify({"error": "Missing 'message' in request body"}), 400
+        return None, (jsonify({"error": "Missing 'message' in request body"}), 400)
 
-    # --- Validate or Create Conversation --- 
-    is_new_conversation = False
     if conversation_id:
         try:
             conversation_id = int(conversation_id) # Ensure it's an integer
-            if not check_conversation_owner(conversation_id, user_id):
-                 print(f"Warning: User {user_id} attempted to access conversation {conversation_id} they don't own. Starting new conversation.")
-                 conversation_id = None # Treat as invalid
-            else:
-                 print(f"Continuing conversation {conversation_id} for user {user_id}")
         except (ValueError, TypeError):
              print(f"Warning: Invalid conversation_id format received: {conversation_id}. Starting new conversation.")
              conversation_id = None
 
-    if not conversation_id:
-        print(f"No valid conversation_id provided. Creating new conversation for user {user_id}.")
-        conversation_id = create_conversation(user_id)
-        if not conversation_id:
-             print(f"ERROR: Failed to create a new conversation for user {user_id}.")
-             return jsonify({"error": "Failed to start a new chat session."}), 500
-        print(f"Started new conversation {conversation_id} for user {user_id}.")
-        is_new_conversation = True # Flag that a new convo was created
-
-    # --- Log User Message (with conversation_id) ---
+    reset_interval_minutes = current_app.config.get('TOKEN_RESET_INTERVAL_MINUTES', 5)
+    token_limit = current_app.config.get('FREE_TIER_TOKEN_LIMIT', 20000)
+    # Reserve what the turn is likely to use: its message plus the typical overhead of a turn
+    reservation = estimate_tokens(message) + get_turn_cost_estimate().overhead
+    is_new_conversation = False
     try:
-        # Pass conversation_id to add_chat_message
-        add_chat_message(user_id, conversation_id, 'user', message)
+        with ChatUnitOfWork() as uow:
+            # --- Token Reset, Limit Check and Reservation (one atomic statement) ---
+            token_details = uow.reserve_tokens(user_id, timedelta(minutes=reset_interval_minutes), token_limit, reservation)
+            limit_reached = bool(token_details) and token_details['limit_reached']
+
+            if token_details and not limit_reached:
+                if token_details['was_reset']:
+                    print(f"User {user_id} token reset interval ({reset_interval_minutes} min) passed. Tokens reset.")
+
+                # --- Validate Conversation and Log User Message (ownership check included) ---
+                if conversation_id:
+                    if uow.add_message(user_id, conversation_id, 'user', message) is None:
+                        print(f"Warning: User {user_id} attempted to access conversation {conversation_id} they don't own. Starting new conversation.")
+                        conversation_id = None # Treat as invalid
+                    else:
+                        print(f"Continuing conversation {conversation_id} for user {user_id}")
+
+                # --- Or Create a Conversation ---
+                if not conversation_id:
+                    print(f"No valid conversation_id provided. Creating new conversation for user {user_id}.")
+                    conversation_id = uow.create_conversation(user_id)
+                    uow.add_message(user_id, conversation_id, 'user', message)
+                    print(f"Started new conversation {conversation_id} for user {user_id}.")
+                    is_new_conversation = True # Flag that a new convo was created
     except Exception as e:
-        # Log error but continue for now
-        print(f"Error saving user message for user {user_id}, convo {conversation_id}: {e}", file=sys.stderr)
+        print(f"Error preparing chat turn for user {user_id} (convo: {conversation_id}): {e}", file=sys.stderr)
         traceback.print_exc()
+        return None, (jsonify({"error": "Failed to start a new chat session."}), 500)
+
+    if not token_details:
+         print(f"Error: Could not retrieve token details for logged-in user {user_id}")
+         return None, (jsonify({"error": "Could not verify user usage details."}), 500)
+
+    # --- Token Limit Check --- 
+    if limit_reached:
+        print(f"User {user_id} reached token limit ({token_details['tokens_used']} >= {token_limit})")
+        
+        # --- Calculate Time Remaining --- 
+        time_remaining_str = "soon" # Default message
+        next_reset_timestamp_iso = None
+        last_reset_time = token_details.get('last_token_reset')
+
+        if last_reset_time:
+            # Ensure last_reset_time is offset-aware UTC
+            if last_reset_time.tzinfo is None:
+                 # If somehow it's naive, assume UTC (though TIMESTAMPTZ should prevent this)
+                 last_reset_time = last_reset_time.replace(tzinfo=timezone.utc)
+            
+            next_reset_time = last_reset_time + timedelta(minutes=reset_interval_minutes)
+            now_utc = datetime.datetime.now(timezone.utc)
+            time_remaining = next_reset_time - now_utc
+            next_reset_timestamp_iso = next_reset_time.isoformat()
+
+            if time_remaining.total_seconds() > 0:
+                total_seconds = int(time_remaining.total_seconds())
+                minutes = total_seconds // 60
+                seconds = total_seconds % 60
+                if minutes > 0:
+                    time_remaining_str = f"in approximately {minutes} minute(s) and {seconds} second(s)"
+                else:
+                    time_remaining_str = f"in approximately {seconds} second(s)"
+            else:
+                time_remaining_str = "very shortly (on your next request)"
+        else:
+            # Should ideally not happen if column has default, but handle anyway
+            time_remaining_str = "on your next request"
+
+        limit_message = f"You have reached your free token limit of {token_limit}. Your tokens will reset {time_remaining_str}."
+        
+        return None, (jsonify({
+            "limit_reached": True,
+            "message": limit_message,
+            "next_reset_at": next_reset_timestamp_iso # Optional: send timestamp for potential frontend timer
+        }), 403)
+
+    turn = {
+        "user_id": user_id,
+        "token_details": token_details, # Includes the token reservation, settled when the turn ends
+        "message": message,
+        "conversation_id": conversation_id,
+        "is_new_conversation": is_new_conversation,
+    }
 
     # --- Proceed with Agency Interaction --- 
     # Get agency from cache or create a new one for this conversation
@@ -256,77 +294,148 @@ def chat_api():
     if not agency:
          # Log error with conversation ID if available
          print(f"ERROR: Agency failed to initialize for request (convo: {conversation_id}, user: {user_id}).")
-         return jsonify({
+         _release_turn_tokens(turn)
+         return None, (jsonify({
              "conversation_id": conversation_id,
              "error": "Agency failed to initialize or retrieve. Check server logs."
-             }), 500
+             }), 500)
 
     print(f"Using agency for convo {conversation_id}. Processing message from user {user_id}.")
+    turn["agency"] = agency
+    return turn, None
+
+def _settle_turn_tokens(turn, tokens_used):
+    """Replaces the turn's token reservation with tokens_used, on its own. Returns True if settled."""
+    token_details = turn["token_details"]
+    if token_details['is_subscribed'] or turn.get("tokens_settled"):
+        return True
+    try:
+        with ChatUnitOfWork() as uow:
+            uow.settle_tokens(turn["user_id"], token_details['reserved'], token_details['reserved_at'], tokens_used)
+        turn["tokens_settled"] = True
+        print(f"User {turn['user_id']} - Settled token reservation ({tokens_used} tokens used)")
+        return True
+    except Exception as e:
+        print(f"Error settling token reservation for user {turn['user_id']}: {e}", file=sys.stderr)
+        return False
+
+def _release_turn_tokens(turn):
+    """Settles the token reservation of a turn that did not finish, with the usage the API
+    reported for it so far (none: the reservation is released)."""
+    usage = turn.get("usage")
+    _settle_turn_tokens(turn, usage.total_tokens if usage is not None else 0)
+
+def _run_agency_turn(turn, on_step, complete):
+    """Runs complete(agency) as this conversation's turn: one turn per conversation at a time,
+    tools using the conversation's state and threads, and every step emitted sent to on_step(step).
+    The token usage the API reports for the turn's runs is collected in turn["usage"]."""
+    conversation_id = turn["conversation_id"]
+    agency = turn["agency"]
+    turn["usage"] = TurnUsage()
+    # Only turns of the same conversation wait for each other; other conversations run concurrently
+    with get_conversation_lock(conversation_id):
+        print(f"Lock acquired for agency completion (convo: {conversation_id})")
+        try:
+            with collect_steps(on_step), collect_usage(turn["usage"]), use_conversation(agency):
+                # *** CRITICAL: Pass the message to the cached/retrieved agency instance ***
+                result = complete(agency)
+        finally:
+            save_agency_threads(conversation_id, agency) # Also keeps threads created by a failed turn
+            _agency_cache.refresh_size(conversation_id) # The conversation's state grew during the turn
+    print(f"Lock released after agency completion (convo: {conversation_id})")
+    return result
+
+def _finish_chat_turn(turn, final_response_text):
+    """Records the turn's token usage for the conversation and the user, and logs the assistant
+    response. Returns total tokens."""
+    user_id = turn["user_id"]
+    conversation_id = turn["conversation_id"]
+
+    # --- Token Usage: as reported by the API for every run of the turn (all agents, instructions,
+    # tool calls); estimated from the visible messages only if the API reported none ---
+    usage = turn.get("usage")
+    if usage is not None and usage.runs:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        print(f"User {user_id} - API usage over {usage.runs} run(s): prompt {prompt_tokens}, "
+              f"completion {completion_tokens} (per agent: {usage.by_agent()})")
+        get_turn_cost_estimate().observe(estimate_tokens(turn["message"]), prompt_tokens + completion_tokens)
+    else:
+        prompt_tokens, completion_tokens = estimate_tokens(turn["message"]), estimate_tokens(final_response_text)
+        print(f"User {user_id} - No usage reported by the API, estimated: prompt {prompt_tokens}, completion {completion_tokens}")
+    total_tokens = prompt_tokens + completion_tokens
+    print(f"User {user_id} - Total tokens: {total_tokens}")
+
+    # --- Record Usage and Log Agent Response (one unit of work) ---
+    try:
+        with ChatUnitOfWork() as uow:
+            # Update usage only if not subscribed: the real usage replaces the turn's reservation
+            token_details = turn["token_details"]
+            if not token_details['is_subscribed']:
+                uow.settle_tokens(user_id, token_details['reserved'], token_details['reserved_at'], total_tokens)
+            # COMMENTED OUT: Don't save system messages (agent steps)
+            # if steps: uow.add_message(user_id, conversation_id, 'system', json.dumps(steps))
+
+            # Save assistant response (also adds the turn's usage to the conversation's totals)
+            uow.add_message(user_id, conversation_id, 'assistant', final_response_text, prompt_tokens, completion_tokens)
+        turn["tokens_settled"] = True
+        print(f"User {user_id} - Recorded usage of {total_tokens} tokens for convo {conversation_id}")
+    except Exception as log_e:
+        # Log error but still return the response to the user
+        print(f"Error recording agent response and usage for convo {conversation_id}: {log_e}", file=sys.stderr)
+        # Still bill the real usage instead of leaving the reservation in place
+        _settle_turn_tokens(turn, total_tokens)
+    return total_tokens
+
+def _complete_with_steps(agency, message):
+    """agency.get_completion(message), emitting tool calls and messages between agents as steps.
+    Returns the final response."""
+    user_name = agency.user.name
+    messages = agency.get_completion(message, yield_messages=True)
+    while True:
+        try:
+            output = next(messages)
+        except StopIteration as e:
+            return e.value
+        if output.msg_type == "function":
+            tool_name = output.obj.function.name if output.obj is not None else output.content
+            emit_step(output.sender_name, f"{output.sender_name} calls {tool_name}", kind="tool_call", tool=tool_name)
+        elif output.msg_type == "text" and user_name not in (output.sender_name, output.receiver_name):
+            emit_step(output.sender_name, f"{output.sender_name} to {output.receiver_name}: {output.content}",
+                      kind="message", recipient=output.receiver_name)
+
+def _run_chat_turn(turn):
+    """Runs a prepared chat turn to completion. Returns (response_payload, status_code)."""
+    user_id = turn["user_id"]
+    conversation_id = turn["conversation_id"]
+    message = turn["message"]
     response_payload = {}
-    captured_steps = ""
+    steps = [] # Structured step events of this turn (see WebsiteMonitor/tools/step_events.py)
     final_response_text = ""
     error_occurred = False
     error_message = ""
 
     try:
-        # --- Token Counting (Prompt) ---
-        prompt_tokens = len(encoding.encode(message))
-        print(f"User {user_id} - Prompt tokens: {prompt_tokens}")
+        # --- Collect this turn's steps during agency completion ---
+        final_response_text = _run_agency_turn(turn, steps.append,
+                                               lambda agency: _complete_with_steps(agency, message))
 
-        # --- Capture stdout during agency completion ---
-        stdout_capture = io.StringIO()
-        try:
-            # Acquire lock specifically around using the potentially shared agency instance
-            with _cache_lock:
-                print(f"Lock acquired for agency completion (convo: {conversation_id})")
-                with contextlib.redirect_stdout(stdout_capture):
-                    # *** CRITICAL: Pass the message to the cached/retrieved agency instance ***
-                    final_response_text = agency.get_completion(message)
-            print(f"Lock released after agency completion (convo: {conversation_id})")
-        finally:
-            captured_steps = stdout_capture.getvalue()
-            # Optional: Print captured steps to actual console for debugging if needed
-            # print("--- Captured Steps ---")
-            # print(captured_steps)
-            # print("--- End Captured Steps ---")
-
-        # --- Token Counting (Completion) & Update Usage ---
-        completion_tokens = len(encoding.encode(final_response_text))
-        total_tokens = prompt_tokens + completion_tokens
-        print(f"User {user_id} - Completion tokens: {completion_tokens}, Total: {total_tokens}")
-
-        # Update usage only if not subscribed
-        if not token_details['is_subscribed']:
-            success = update_token_usage(user_id, total_tokens)
-            if not success:
-                # Log error but potentially still return response to user?
-                print(f"Warning: Failed to update token usage for user {user_id}")
-            else:
-                 print(f"User {user_id} - Updated token usage by {total_tokens}")
+        _finish_chat_turn(turn, final_response_text)
 
         # --- Prepare Response Payload --- 
         response_payload = {
             "conversation_id": conversation_id, # Return the conversation ID
-            "is_new_conversation": is_new_conversation, # Indicate if a new one was made
+            "is_new_conversation": turn["is_new_conversation"], # Indicate if a new one was made
             "response": final_response_text,
-            "steps": captured_steps,
+            "steps": steps,
             "limit_reached": False
         }
 
-        # --- Log Agent Response (with conversation_id) ---
-        try:
-            # COMMENTED OUT: Don't save system messages (agent steps)
-            # if captured_steps.strip(): add_chat_message(user_id, conversation_id, 'system', f"--- Agent Steps ---\n{captured_steps}")
-            
-            # Save assistant response
-            add_chat_message(user_id, conversation_id, 'assistant', final_response_text)
-        except Exception as log_e: print(f"Error logging agent response for convo {conversation_id}: {log_e}", file=sys.stderr)
-
     except Exception as e:
         error_occurred = True
         error_message = f"An internal error occurred processing your request."
         print(f"Error during agency completion for convo {conversation_id}: {e}", file=sys.stderr)
         traceback.print_exc()
+        _release_turn_tokens(turn)
         response_payload = {"conversation_id": conversation_id, "error": error_message}
         # --- Log Error Message (with conversation_id) ---
         try:
@@ -335,25 +444,213 @@ def chat_api():
             pass # No action needed here now
         except Exception as log_e: print(f"Error logging error message for convo {conversation_id}: {log_e}", file=sys.stderr)
 
-    # --- Return JSON Response ---
     status_code = 500 if error_occurred else 200
     print(f"API sending response for convo {conversation_id} (Status: {status_code})") # Log convo ID
+    return response_payload, status_code
+
+@_api_bp.route('/chat', methods=['POST'], endpoint='agency_chat')
+@login_required
+def chat_api():
+    user_id = current_user.id
+    turn, error_response = _begin_chat_turn(user_id)
+    if error_response:
+        return error_response
+
+    # --- Async Job Mode: run the turn in the background and return a job ID right away ---
+    if request.get_json().get('async'):
+        return _submit_chat_job(turn)
+
+    # --- Return JSON Response ---
+    response_payload, status_code = _run_chat_turn(turn)
     return jsonify(response_payload), status_code 
 
+# --- Streaming Chat (Server-Sent Events) ---
+SSE_KEEPALIVE_SECONDS = 15 # Comment line sent while the agency is quiet, so proxies keep the connection open
+
+def _sse(event, data, event_id=None):
+    """Formats one Server-Sent Event."""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _make_stream_handler(emit, user_name):
+    """Event handler class (Agency Swarm wants a class, and keeps state on it) for one streamed turn.
+
+    Text of the main thread (the user's conversation with the CEO) becomes 'token' events;
+    tool calls and messages between agents are emitted as steps.
+    """
+    class ChatStreamHandler(AgencyEventHandler):
+        def on_text_delta(self, delta, snapshot):
+            if self.agent_name == user_name and delta.value:
+                emit("token", {"text": delta.value})
+
+        def on_tool_call_done(self, tool_call):
+            if tool_call.type == "function":
+                emit_step(self.recipient_agent_name, f"{self.recipient_agent_name} calls {tool_call.function.name}",
+                          kind="tool_call", tool=tool_call.function.name)
+
+        def on_message_done(self, message):
+            if self.agent_name == user_name:
+                return # Streamed as tokens
+            text = "\n".join(part.text.value for part in message.content if part.type == "text")
+            if text:
+                emit_step(self.recipient_agent_name, f"{self.recipient_agent_name} to {self.agent_name}: {text}",
+                          kind="message", recipient=self.agent_name)
+
+    return ChatStreamHandler
+
+def _stream_chat_turn(turn, emit):
+    """Runs a chat turn with streaming, reporting it through emit(event, data): 'step' (a step
+    event) and 'token' events while it runs, then 'done' (response) or 'error'. Records usage
+    and the response."""
+    conversation_id = turn["conversation_id"]
+    message = turn["message"]
+    try:
+        handler = _make_stream_handler(emit, turn["agency"].user.name)
+        final_response_text = _run_agency_turn(
+            turn, lambda step: emit("step", step),
+            lambda agency: agency.get_completion_stream(message, event_handler=handler))
+        _finish_chat_turn(turn, final_response_text)
+        emit("done", {"conversation_id": conversation_id, "response": final_response_text})
+    except Exception as e:
+        print(f"Error during streamed agency completion for convo {conversation_id}: {e}", file=sys.stderr)
+        traceback.print_exc()
+        _release_turn_tokens(turn)
+        emit("error", {"conversation_id": conversation_id,
+                       "error": "An internal error occurred processing your request."})
+
+@_api_bp.route('/chat/stream', methods=['POST'], endpoint='agency_chat_stream')
+@login_required
+def chat_stream_api():
+    """Like /api/chat, but streams the turn as Server-Sent Events: 'meta' (conversation_id,
+    is_new_conversation), then 'step' and 'token' events as they happen, and finally 'done'
+    (response) or 'error'. Quota and request errors are returned as JSON, as in /api/chat.
+
+    The turn runs on its own thread and is completed and saved even if the client disconnects.
+    """
+    user_id = current_user.id
+    turn, error_response = _begin_chat_turn(user_id)
+    if error_response:
+        return error_response
+    conversation_id = turn["conversation_id"]
+    events = queue.Queue()
+
+    emit = lambda event, data: events.put((event, data))
+    threading.Thread(target=_stream_chat_turn, args=(turn, emit), name=f"chat-stream-{conversation_id}", daemon=True).start()
+
+    def generate():
+        yield _sse("meta", {"conversation_id": conversation_id, "is_new_conversation": turn["is_new_conversation"]})
+        while True:
+            try:
+                event, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(event, data)
+            if event in ("done", "error"):
+                print(f"API finished stream for convo {conversation_id} ({event})")
+                return
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}) # No proxy buffering
+
+# --- Async Chat Jobs ---
+MAX_JOB_WAIT_SECONDS = 60 # Upper bound for ?wait= long-polls (below the gunicorn timeout)
+_chat_jobs = ChatJobQueue() # Bounded by CHAT_JOB_MAX_WORKERS / CHAT_JOB_MAX_PENDING
+
+def _submit_chat_job(turn):
+    """Queues a prepared chat turn as a background job. Returns the JSON response (202 Accepted)."""
+    conversation_id = turn["conversation_id"]
+    job = _chat_jobs.submit(turn["user_id"], conversation_id, turn["is_new_conversation"],
+                            lambda emit: _stream_chat_turn(turn, emit))
+    if job is None:
+        _release_turn_tokens(turn)
+        return jsonify({"conversation_id": conversation_id,
+                        "error": "Too many requests are being processed. Please try again shortly."}), 503
+    payload = job.to_dict()
+    payload["status_url"] = url_for('agency_api.get_chat_job', job_id=job.id)
+    return jsonify(payload), 202
+
+@_api_bp.route('/jobs/<job_id>', methods=['GET'], endpoint='get_chat_job')
+@login_required
+def get_chat_job_api(job_id):
+    """Status and result of a chat job (see 'async' in /api/chat).
+
+    ?wait=N long-polls up to N seconds for the job to finish. With ?stream=1 (or
+    Accept: text/event-stream) the job's events are sent as Server-Sent Events, the
+    same as /api/chat/stream, starting after ?after=N or the Last-Event-ID header.
+    """
+    job = _chat_jobs.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({"error": "Job not found or access denied"}), 404
+
+    wants_stream = request.args.get('stream') in ('1', 'true') or request.accept_mimetypes.best == 'text/event-stream'
+    if wants_stream:
+        try:
+            after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+        except ValueError:
+            after = 0
+
+        def generate():
+            index = after
+            if index == 0:
+                yield _sse("meta", {"conversation_id": job.conversation_id,
+                                    "is_new_conversation": job.is_new_conversation, "job_id": job.id})
+            while True:
+                new_events = job.wait(SSE_KEEPALIVE_SECONDS, after=index)
+                if not new_events and not job.finished:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event, data in new_events:
+                    index += 1
+                    yield _sse(event, data, event_id=index) # ID = events sent so far, for reconnects
+                if job.finished and index >= len(job.events):
+                    return
+
+        return Response(generate(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    try:
+        wait_seconds = min(float(request.args.get('wait', 0)), MAX_JOB_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "'wait' must be a number of seconds"}), 400
+    if wait_seconds > 0 and not job.finished:
+        job.wait(wait_seconds)
+    return jsonify(job.to_dict()), 200
+
 # --- Endpoint to get messages for a conversation --- 
+MESSAGES_PAGE_SIZE = 50 # Default ?limit= of the messages endpoint
+MAX_MESSAGES_PAGE_SIZE = 200
+
 @_api_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'], endpoint='get_conversation_messages')
 @login_required
 def get_messages_api(conversation_id):
+    """One page of the conversation's user and assistant messages.
+
+    Returns the newest ?limit=N messages (default 50), or those older than the message
+    ?before_id=ID, in chronological order, with "has_more" and "next_before_id" (the
+    before_id of the next older page).
+    """
     user_id = current_user.id
+    try:
+        limit = min(int(request.args.get('limit', MESSAGES_PAGE_SIZE)), MAX_MESSAGES_PAGE_SIZE)
+        before_id = request.args.get('before_id', type=int)
+        if limit < 1 or ('before_id' in request.args and before_id is None):
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "'limit' and 'before_id' must be positive integers"}), 400
     if not check_conversation_owner(conversation_id, user_id):
         return jsonify({"error": "Conversation not found or access denied"}), 404
     try:
-        messages = get_chat_history(conversation_id)
-        # Filter messages to include only 'user' and 'assistant' roles
-        filtered_messages = [msg for msg in messages if msg[3] in ('user', 'assistant')]
-        # Format the filtered messages for easier JS consumption
-        formatted_messages = [{'role': msg[3], 'content': msg[4]} for msg in filtered_messages]
-        return jsonify(formatted_messages), 200
+        # One extra row tells whether an older page exists
+        messages = get_chat_history(conversation_id, limit=limit + 1, before_id=before_id, roles=('user', 'assistant'))
+        has_more = len(messages) > limit
+        page = messages[:limit]
+        page.reverse() # Oldest first, as the chat displays them
+        return jsonify({
+            "messages": [{'id': msg['id'], 'role': msg['role'], 'content': msg['content']} for msg in page],
+            "has_more": has_more,
+            "next_before_id": page[0]['id'] if has_more else None,
+        }), 200
     except Exception as e:
         print(f"Error fetching messages for conversation {conversation_id}: {e}", file=sys.stderr)
         traceback.print_exc()
@@ -370,10 +667,8 @@ def delete_conversation_api(conversation_id):
     
     if success:
         # Also remove from cache if it exists (though it might be evicted already)
-        with _cache_lock:
-            if conversation_id in _agency_cache:
-                del _agency_cache[conversation_id]
-                print(f"Removed deleted conversation {conversation_id} from agency cache.")
+        if _agency_cache.discard(conversation_id):
+            print(f"Removed deleted conversation {conversation_id} from agency cache.")
         return jsonify({"success": True, "message": "Conversation deleted successfully"}), 200
     else:
         # delete_conversation handles logging the reason (not found, owner mismatch, db error)
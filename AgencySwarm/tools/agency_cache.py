@@ -0,0 +1,242 @@
+# AgencySwarm/tools/agency_cache.py
+"""In-memory cache of per-conversation agencies.
+
+Entries are evicted least-recently-used first when the cache holds more than
+max_entries or its approximate memory exceeds max_bytes, and by a background
+sweeper once they have been idle for longer than idle_ttl. Evicting is cheap:
+a conversation's thread IDs are in the database, so a later request just
+clones the template agency again.
+
+Builds are single-flight: the first caller for a missing key builds it outside
+the cache lock, concurrent callers for the same key wait for that build.
+Hit, miss, eviction and build-latency counters are available from stats() and
+are logged periodically.
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# --- Configuration Defaults ---
+DEFAULT_MAX_ENTRIES = int(os.getenv("AGENCY_CACHE_MAX_ENTRIES", 50))
+DEFAULT_IDLE_TTL_SECONDS = float(os.getenv("AGENCY_CACHE_IDLE_TTL_SECONDS", 1800)) # 0 = never expire
+DEFAULT_MAX_MEMORY_MB = float(os.getenv("AGENCY_CACHE_MAX_MEMORY_MB", 0)) # 0 = no memory budget
+DEFAULT_LOG_INTERVAL_SECONDS = float(os.getenv("AGENCY_CACHE_LOG_INTERVAL_SECONDS", 300)) # 0 = no stats log line
+MAX_SWEEP_INTERVAL_SECONDS = 60
+
+def _deep_sizeof(obj, skip, depth=8):
+    """Approximate size in bytes of obj and what it references, not counting ids in `skip`."""
+    if depth < 0 or id(obj) in skip:
+        return 0
+    skip.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        items = [item for pair in obj.items() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = list(obj)
+    else:
+        items = list(getattr(obj, '__dict__', {}).values())
+    return size + sum(_deep_sizeof(item, skip, depth - 1) for item in items)
+
+def estimate_agency_bytes(agency, shared=()):
+    """Approximate memory owned by one conversation's agency: its threads (with their last run)
+    and shared state. Objects in `shared` (template agents, API clients, ...) are not counted."""
+    skip = {id(obj) for obj in shared}
+    size = _deep_sizeof(agency.shared_state.data, skip)
+    for agent_name, threads in agency.agents_and_threads.items():
+        for thread in ([threads] if agent_name == "main_thread" else threads.values()):
+            skip.update((id(thread.agent), id(thread.recipient_agent), id(thread.client)))
+            size += _deep_sizeof(thread, skip)
+    return size
+
+class AgencyCache:
+    """LRU + idle-TTL + memory-bounded cache with single-flight builds."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, idle_ttl=DEFAULT_IDLE_TTL_SECONDS,
+                 max_bytes=DEFAULT_MAX_MEMORY_MB * 1024 * 1024, size_of=None,
+                 log_interval=DEFAULT_LOG_INTERVAL_SECONDS):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.size_of = size_of # value -> approximate bytes (None: memory is not tracked)
+        self.log_interval = log_interval
+
+        self._entries = OrderedDict() # key -> [value, last_used (monotonic), approx_bytes]; oldest first
+        self._builds = {} # key -> Future of the build in progress
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop_event = threading.Event()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0, # Misses that waited for another caller's build
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "builds": 0,
+            "build_failures": 0,
+            "build_seconds_total": 0.0,
+            "build_seconds_last": 0.0,
+            "build_seconds_max": 0.0,
+        }
+
+    # --- Internal helpers (call with self._lock held) ---
+    def _evict(self, key, reason):
+        value, _, size = self._entries.pop(key)
+        self._bytes -= size
+        self._stats[f"evictions_{reason}"] += 1
+        print(f"Agency cache: evicted conversation {key} ({reason}).")
+        return value
+
+    def _enforce_limits(self):
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)), "lru")
+        while self.max_bytes and self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._evict(next(iter(self._entries)), "memory") # The newest entry always stays
+
+    def _expire_idle(self, now):
+        if not self.idle_ttl:
+            return
+        while self._entries:
+            key, (_, last_used, _) = next(iter(self._entries.items()))
+            if now - last_used <= self.idle_ttl:
+                break # Entries are in last-used order
+            self._evict(key, "ttl")
+
+    def _measure(self, value):
+        if self.size_of is None:
+            return 0
+        try:
+            return self.size_of(value)
+        except Exception as e:
+            print(f"Agency cache: could not estimate entry size: {e}", file=sys.stderr)
+            return 0
+
+    # --- Public API ---
+    def get_or_build(self, key, build):
+        """Returns the cached value for key, or build(key) (cached unless it returned None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+            pending = self._builds.get(key)
+            if pending is None:
+                pending = self._builds[key] = Future()
+                is_builder = True
+            else:
+                self._stats["waits"] += 1
+                is_builder = False
+
+        if not is_builder:
+            return pending.result() # None if that build failed
+
+        value = None
+        start = time.perf_counter()
+        try:
+            value = build(key)
+        finally:
+            elapsed = time.perf_counter() - start
+            size = self._measure(value) if value is not None else 0
+            with self._lock:
+                del self._builds[key]
+                self._stats["builds"] += 1
+                if value is None:
+                    self._stats["build_failures"] += 1
+                self._stats["build_seconds_total"] += elapsed
+                self._stats["build_seconds_last"] = elapsed
+                self._stats["build_seconds_max"] = max(self._stats["build_seconds_max"], elapsed)
+                if value is not None:
+                    self._entries[key] = [value, time.monotonic(), size]
+                    self._bytes += size
+                    self._enforce_limits()
+            pending.set_result(value) # Wake up callers waiting for this key
+            print(f"Agency cache: built conversation {key} in {elapsed:.2f}s ({'ok' if value is not None else 'failed'}).")
+            self._start_sweeper()
+        return value
+
+    def refresh_size(self, key):
+        """Re-estimates an entry's memory (it grows as the conversation runs) and applies the budget."""
+        with self._lock:
+            entry = self._entries.get(key)
+            value = entry[0] if entry else None
+        if value is None or self.size_of is None:
+            return
+        size = self._measure(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            self._bytes += size - entry[2]
+            entry[2] = size
+            self._enforce_limits()
+
+    def discard(self, key):
+        """Drops an entry (e.g. its conversation was deleted). Not counted as an eviction."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+            return entry is not None
+
+    def stats(self):
+        """Snapshot of the counters plus current size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["approx_bytes"] = self._bytes
+        stats["hit_rate"] = stats["hits"] / (stats["hits"] + stats["misses"]) if stats["hits"] + stats["misses"] else 0.0
+        stats["build_seconds_mean"] = stats["build_seconds_total"] / stats["builds"] if stats["builds"] else 0.0
+        return stats
+
+    def log_stats(self):
+        s = self.stats()
+        print(f"Agency cache: {s['entries']} entries (~{s['approx_bytes'] / (1024 * 1024):.1f} MB), "
+              f"hits {s['hits']}, misses {s['misses']} (hit rate {s['hit_rate']:.0%}), "
+              f"evictions lru/ttl/memory {s['evictions_lru']}/{s['evictions_ttl']}/{s['evictions_memory']}, "
+              f"builds {s['builds']} ({s['build_failures']} failed, mean {s['build_seconds_mean'] * 1000:.0f} ms, "
+              f"max {s['build_seconds_max'] * 1000:.0f} ms)")
+
+    # --- Background expiry ---
+    def _start_sweeper(self):
+        if self._sweeper is not None or not (self.idle_ttl or self.log_interval):
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="AgencyCacheSweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        intervals = [MAX_SWEEP_INTERVAL_SECONDS]
+        if self.idle_ttl:
+            intervals.append(max(1.0, self.idle_ttl / 2))
+        if self.log_interval:
+            intervals.append(self.log_interval)
+        sweep_interval = min(intervals)
+        next_log = time.monotonic() + self.log_interval if self.log_interval else None
+        last_logged = None
+        while not self._stop_event.wait(sweep_interval):
+            try:
+                now = time.monotonic()
+                with self._lock:
+                    self._expire_idle(now)
+                if next_log is not None and now >= next_log:
+                    next_log = now + self.log_interval
+                    activity = (self._stats["hits"], self._stats["misses"])
+                    if activity != last_logged: # Quiet when there was no traffic
+                        last_logged = activity
+                        self.log_stats()
+            except Exception as e:
+                print(f"Agency cache sweeper error: {e}", file=sys.stderr)
+
+    def stop(self):
+        """Stops the background sweeper."""
+        self._stop_event.set()
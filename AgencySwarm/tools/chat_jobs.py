@@ -0,0 +1,141 @@
+# AgencySwarm/tools/chat_jobs.py
+"""Background execution of chat turns.
+
+A job runs one chat turn on a bounded worker pool (so only so many turns talk
+to the OpenAI API at once) and records the events the turn emits ('step',
+'token', then 'done' or 'error'). Clients poll, long-poll or stream a job's
+events instead of holding a request open for the whole turn.
+
+Jobs live in the memory of the worker process that accepted them and are
+forgotten JOB_RETENTION_SECONDS after they finish.
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration Defaults ---
+DEFAULT_MAX_WORKERS = int(os.getenv("CHAT_JOB_MAX_WORKERS", 4)) # Turns running at once
+DEFAULT_MAX_PENDING = int(os.getenv("CHAT_JOB_MAX_PENDING", 100)) # Queued + running jobs before new ones are refused
+JOB_RETENTION_SECONDS = float(os.getenv("CHAT_JOB_RETENTION_SECONDS", 900))
+
+class ChatJob:
+    """State and event log of one background chat turn."""
+
+    def __init__(self, user_id, conversation_id, is_new_conversation):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.is_new_conversation = is_new_conversation
+        self.status = "queued" # queued -> running -> done | error
+        self.response = None
+        self.error = None
+        self.events = [] # (event, data) in the order emitted
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def _set_running(self):
+        with self._cond:
+            self.status = "running"
+            self.started_at = time.time()
+            self._cond.notify_all()
+
+    def emit(self, event, data):
+        """Records an event of the turn; 'done' and 'error' finish the job."""
+        with self._cond:
+            if self.finished:
+                return
+            self.events.append((event, data))
+            if event == "done":
+                self.status = "done"
+                self.response = data.get("response")
+            elif event == "error":
+                self.status = "error"
+                self.error = data.get("error")
+            if self.finished:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait(self, timeout, after=None):
+        """Blocks until the job has finished (or, if `after` is given, has more than `after` events),
+        for at most `timeout` seconds. Returns the events after index `after` (all if None)."""
+        start = after or 0
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished or (after is not None and len(self.events) > after), timeout)
+            return list(self.events[start:])
+
+    def to_dict(self):
+        """Status and result of the job, for the API."""
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "conversation_id": self.conversation_id,
+                "is_new_conversation": self.is_new_conversation,
+                "response": self.response,
+                "error": self.error,
+                "steps": [data for event, data in self.events if event == "step"],
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+class ChatJobQueue:
+    """Runs chat jobs on a bounded thread pool and keeps them until they expire."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 retention=JOB_RETENTION_SECONDS):
+        self.max_pending = max_pending
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-job")
+        self._jobs = {} # job_id -> ChatJob
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        """Forgets finished jobs older than the retention period (call with self._lock held)."""
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, user_id, conversation_id, is_new_conversation, run):
+        """Queues run(emit) as a new job. Returns the job, or None if too many jobs are pending."""
+        with self._lock:
+            self._prune(time.time())
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                print(f"Chat job queue full ({pending} pending). Refusing job for conversation {conversation_id}.")
+                return None
+            job = ChatJob(user_id, conversation_id, is_new_conversation)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        print(f"Queued chat job {job.id} for conversation {conversation_id}.")
+        return job
+
+    def _run(self, job, run):
+        job._set_running()
+        try:
+            run(job.emit)
+        except Exception as e:
+            print(f"Chat job {job.id} failed: {e}")
+            job.emit("error", {"conversation_id": job.conversation_id,
+                               "error": "An internal error occurred processing your request."})
+        finally:
+            if not job.finished: # The turn returned without reporting a result
+                job.emit("error", {"conversation_id": job.conversation_id, "error": "The request ended without a response."})
+
+    def get(self, job_id, user_id):
+        """Returns the job if it exists and belongs to the user, else None."""
+        with self._lock:
+            self._prune(time.time())
+            job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
@@ -0,0 +1,105 @@
+# AgencySwarm/tools/token_usage.py
+"""Token usage of chat turns, as reported by the OpenAI API.
+
+Every Assistants run reports its usage (prompt and completion tokens, which
+include the instructions, tool calls and tool outputs of the run) once it has
+finished. Conversations use UsageRecordingThread for their threads, which hands
+each finished run to the collector of the running turn, so a turn's usage adds
+up the runs of every agent involved: the CEO's main thread and the threads the
+CEO talks to the other agents through.
+
+A turn collects its usage with collect_usage(TurnUsage()). The collector lives
+in a context variable, like the step sink in WebsiteMonitor/tools/step_events.py,
+so concurrent turns do not mix their numbers.
+"""
+import threading
+import contextlib
+import contextvars
+
+from agency_swarm.threads import Thread
+
+_usage_collector = contextvars.ContextVar('usage_collector', default=None)
+
+class TurnUsage:
+    """Token usage of the runs of one chat turn (one entry per run, so re-reported runs count once)."""
+
+    def __init__(self):
+        self._runs = {} # run_id -> (agent_name, prompt_tokens, completion_tokens)
+        self._lock = threading.Lock() # Tools may run on several threads
+
+    def add_run(self, run, agent_name):
+        usage = run.usage
+        with self._lock:
+            self._runs[run.id] = (agent_name, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+    @property
+    def runs(self):
+        return len(self._runs)
+
+    @property
+    def prompt_tokens(self):
+        with self._lock:
+            return sum(prompt for _, prompt, _ in self._runs.values())
+
+    @property
+    def completion_tokens(self):
+        with self._lock:
+            return sum(completion for _, _, completion in self._runs.values())
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def by_agent(self):
+        """Total tokens per agent that ran."""
+        totals = {}
+        with self._lock:
+            for agent_name, prompt, completion in self._runs.values():
+                totals[agent_name] = totals.get(agent_name, 0) + prompt + completion
+        return totals
+
+class TurnCostEstimate:
+    """Running mean of the tokens a turn uses beyond the user's message (instructions, tool calls,
+    messages between agents, the answer), over the turns finished in this process. Sizes the
+    free-tier reservation of new turns."""
+
+    def __init__(self, initial, weight=0.1):
+        self._mean = float(initial)
+        self._weight = weight # Exponential moving average: recent turns count most
+        self._lock = threading.Lock()
+
+    def observe(self, message_tokens, total_tokens):
+        with self._lock:
+            self._mean += self._weight * (max(0, total_tokens - message_tokens) - self._mean)
+
+    @property
+    def overhead(self):
+        return int(self._mean)
+
+@contextlib.contextmanager
+def collect_usage(usage):
+    """Adds the runs finished in this context to usage (a TurnUsage)."""
+    token = _usage_collector.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage_collector.reset(token)
+
+class UsageRecordingThread(Thread):
+    """Agency Swarm thread that reports the usage of its runs to the active collector.
+
+    Thread keeps the run it is working on in self._run and replaces it with every
+    API response (create, poll, submit tool outputs, stream end); a run carries
+    its usage once it has finished.
+    """
+
+    @property
+    def _run(self):
+        return self.__dict__.get('_current_run')
+
+    @_run.setter
+    def _run(self, run):
+        self.__dict__['_current_run'] = run
+        usage = _usage_collector.get()
+        if usage is not None and getattr(run, 'usage', None) is not None:
+            usage.add_run(run, self.recipient_agent.name)
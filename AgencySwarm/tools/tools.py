@@ -1,3 +1,142 @@
 # AgencySwarm/tools/tools.py
-# Placeholder for potential tools related to Agency Swarm management or interaction,
-# distinct from the tools used *by* the agents themselves. 
\ No newline at end of file
+# Helpers for running Agency Swarm interactions from the web app,
+# distinct from the tools used *by* the agents themselves.
+
+import copy
+import threading
+import contextlib
+import contextvars
+from collections.abc import Mapping
+
+from agency_swarm.threads import Thread
+from agency_swarm.util.shared_state import SharedState
+
+from .token_usage import UsageRecordingThread
+
+# --- Per-Conversation Locks ---
+# Turns of the same conversation must run one at a time (they share one agency and its threads);
+# different conversations only contend when they hash to the same stripe.
+CONVERSATION_LOCK_STRIPES = 64
+_conversation_locks = [threading.Lock() for _ in range(CONVERSATION_LOCK_STRIPES)]
+
+def get_conversation_lock(conversation_id):
+    """Returns the lock that serializes turns of a conversation."""
+    return _conversation_locks[hash(conversation_id) % CONVERSATION_LOCK_STRIPES]
+
+# --- Per-Conversation Shared State ---
+# Agency Swarm stores the shared state on the tool *classes*, so every agency built in this
+# process would share the state of whichever agency was built last. Tool classes get this
+# router instead, which forwards to the state of the conversation running in the current context.
+_active_shared_state = contextvars.ContextVar('active_shared_state', default=None)
+
+class ConversationSharedState(SharedState):
+    """SharedState that forwards to the shared state activated with use_shared_state()."""
+
+    def __init__(self):
+        self._fallback = SharedState() # Used outside of any conversation (e.g. tools run directly)
+
+    @property
+    def data(self):
+        return (_active_shared_state.get() or self._fallback).data
+
+shared_state_router = ConversationSharedState()
+
+def route_tool_shared_state(agents):
+    """Points agents and their tool classes at the per-conversation shared state router.
+
+    Call it before building the Agency (which then keeps the agents' state instead
+    of repointing tool classes that running conversations use) and again after,
+    for the tools the Agency adds itself.
+    """
+    for agent in agents:
+        agent.shared_state = shared_state_router # The setter also updates the agent's tool classes
+
+@contextlib.contextmanager
+def use_shared_state(shared_state):
+    """Makes tools running in this context read and write the given SharedState."""
+    token = _active_shared_state.set(shared_state)
+    try:
+        yield shared_state
+    finally:
+        _active_shared_state.reset(token)
+
+# --- Per-Conversation Agency Threads ---
+# SendMessage tool classes keep the agency's agents_and_threads as a class attribute, so agencies
+# sharing agents would also share their threads. They get this router instead, which forwards to
+# the threads of the conversation running in the current context.
+_active_agents_and_threads = contextvars.ContextVar('active_agents_and_threads', default=None)
+
+class ConversationThreads(Mapping):
+    """Read-only view of the agents_and_threads activated with use_conversation()."""
+
+    def __init__(self):
+        self._fallback = {} # The template agency's threads (used outside of any conversation)
+
+    def _target(self):
+        active = _active_agents_and_threads.get()
+        return self._fallback if active is None else active
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+threads_router = ConversationThreads()
+
+def route_agency_threads(agency):
+    """Points the agency's SendMessage tools at the per-conversation threads router."""
+    threads_router._fallback = agency.agents_and_threads
+    for agent in agency.agents:
+        for tool in agent.tools:
+            if hasattr(tool, '_agents_and_threads'):
+                tool._agents_and_threads = threads_router
+
+def clone_agency(template, thread_ids=None):
+    """Per-conversation copy of a template agency.
+
+    The copy shares the template's agents (and so their assistants and tools) and
+    gets its own threads (UsageRecordingThread, so turns can count their token
+    usage) and shared state. Threads are resumed from `thread_ids`
+    (format of get_agency_thread_ids) where given, otherwise created on first use.
+    Only valid for templates whose SendMessage tools go through route_agency_threads().
+    """
+    thread_ids = thread_ids or {}
+    agency = copy.copy(template)
+    agency.shared_state = SharedState()
+    thread_type = UsageRecordingThread if template._thread_type is Thread else template._thread_type
+    agency.main_thread = UsageRecordingThread(template.user, template.ceo)
+    agency.main_thread.id = thread_ids.get("main_thread")
+    agency.agents_and_threads = {"main_thread": agency.main_thread}
+    for agent_name, threads in template.agents_and_threads.items():
+        if agent_name == "main_thread":
+            continue
+        saved = thread_ids.get(agent_name) or {}
+        agency.agents_and_threads[agent_name] = {}
+        for other_agent, thread in threads.items():
+            clone = thread_type(thread.agent, thread.recipient_agent)
+            clone.id = saved.get(other_agent)
+            agency.agents_and_threads[agent_name][other_agent] = clone
+    return agency
+
+def get_agency_thread_ids(agency):
+    """Thread IDs of an agency, in Agency Swarm's threads_callbacks format (None for threads not created yet)."""
+    thread_ids = {"main_thread": agency.main_thread.id}
+    for agent_name, threads in agency.agents_and_threads.items():
+        if agent_name == "main_thread":
+            continue
+        thread_ids[agent_name] = {other_agent: thread.id for other_agent, thread in threads.items()}
+    return thread_ids
+
+@contextlib.contextmanager
+def use_conversation(agency):
+    """Makes tools running in this context use the agency's shared state and threads."""
+    token = _active_agents_and_threads.set(agency.agents_and_threads)
+    try:
+        with use_shared_state(agency.shared_state):
+            yield agency
+    finally:
+        _active_agents_and_threads.reset(token)
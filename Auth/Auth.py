@@ -22,7 +22,7 @@ import sys
 # Assumes Database module is at the same level as Auth
 # Import directly from database_manager again
 from Database.database_manager import (
-    User, get_user_by_id, get_user_by_email, add_user, get_user_by_google_id, update_username,
+    User, get_user_by_id, get_cached_user, get_user_by_email, add_user, get_user_by_google_id, update_username,
     set_verification_code, get_verification_details, verify_user # Add verification functions
 )
 from .utils import send_verification_email # Import the email sending function
@@ -55,17 +55,8 @@ def create_auth_blueprint(login_manager):
         except (ValueError, TypeError):
             print(f"Warning: Invalid user_id format '{user_id}' received from session cookie. Treating as logged out.")
             return None
-        # db_user is (id, username, pwd_hash, google_id, tokens, subscribed, last_reset)
-        db_user = get_user_by_id(user_id_int)
-        if db_user:
-            # Unpack all columns including new ones
-            # Indices: 0:id, 1:username, 2:pwd_hash, 3:google_id, 4:tokens, 5:subscribed, 6:last_reset
-            #          7:first_name, 8:last_name, 9:email, 10:is_verified
-            return User(id=db_user[0], username=db_user[1], password_hash=db_user[2],
-                        google_id=db_user[3], tokens_used=db_user[4], is_subscribed=db_user[5],
-                        last_token_reset=db_user[6],
-                        first_name=db_user[7], last_name=db_user[8], email=db_user[9], is_verified=db_user[10])
-        return None
+        # Cached per process (see get_cached_user); token counters are not on the cached user
+        return get_cached_user(user_id_int)
 
     @login_manager.unauthorized_handler
     def unauthorized():
@@ -0,0 +1,217 @@
+# Database/connection_pool.py
+"""Thread-safe PostgreSQL connection pool.
+
+Replaces psycopg2's SimpleConnectionPool, which is not thread-safe and raises as
+soon as all connections are in use:
+
+*   getconn() waits (up to `timeout` seconds) for a connection to be returned
+    when the pool is at max_size, instead of failing right away. At most
+    `max_waiting` threads wait; beyond that getconn() fails at once, so an
+    overloaded database sheds load instead of piling up blocked threads.
+*   Connections idle for longer than ping_after are checked with `SELECT 1`
+    before they are handed out; connections older than max_lifetime, idle for
+    longer than max_idle (above min_size) or failing the check are replaced.
+*   putconn() rolls back whatever transaction the borrower left open, and drops
+    connections in an unknown (broken) state.
+
+Counters (in use, waiting, wait time, timeouts, rejections, replaced connections) are
+available from stats().
+"""
+import time
+import threading
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+class PoolTimeout(PoolError):
+    """No connection became available within the acquire timeout."""
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections with a wait queue, health checks and metrics."""
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=30.0, max_waiting=100, ping_after=30.0,
+                 max_idle=600.0, max_lifetime=3600.0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout # Seconds getconn() waits for a free connection
+        self.max_waiting = max_waiting # Threads allowed to wait at once (None = no limit)
+        self.ping_after = ping_after # Idle seconds after which a connection is checked before use
+        self.max_idle = max_idle # Idle seconds after which connections above min_size are closed (0 = never)
+        self.max_lifetime = max_lifetime # Seconds after which a connection is replaced (0 = never)
+
+        self._idle = deque() # (conn, created_at, last_used), most recently returned last
+        self._created_at = {} # id(conn) -> created_at, for connections handed out
+        self._size = 0 # Open connections (idle + in use + being opened)
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            "acquires": 0,
+            "waits": 0, # Acquires that had to wait for a connection
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "rejected": 0, # Acquires refused at once because max_waiting threads were already waiting
+            "connections_opened": 0,
+            "connections_recycled": 0, # Closed for age or idleness
+            "ping_failures": 0,
+            "discarded": 0, # Returned closed or in a broken state
+        }
+
+        for _ in range(min_size): # Fail early (like SimpleConnectionPool) if the database is unreachable
+            self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._size -= 1
+                raise
+            now = time.monotonic()
+            self._idle.append((conn, now, now))
+
+    # --- Internal helpers ---
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self._stats["connections_opened"] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _drop(self, conn, reason=None):
+        """Closes a connection that counted towards the pool size and lets a waiter open a new one."""
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            if reason:
+                self._stats[reason] += 1
+            self._cond.notify()
+
+    def _expired(self, created_at, last_used, now):
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return True
+        return bool(self.max_idle) and now - last_used > self.max_idle and self._size > self.min_size
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    # --- Public API ---
+    def getconn(self, timeout=None):
+        """Returns a healthy connection, waiting up to `timeout` (default: the pool's) seconds
+        for one to be returned if the pool is at max_size. Raises PoolTimeout if none is, or at
+        once if max_waiting threads are already waiting."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                while not self._idle and self._size >= self.max_size:
+                    if not waited and self.max_waiting is not None and self._waiting >= self.max_waiting:
+                        self._stats["rejected"] += 1
+                        raise PoolTimeout(f"no database connection available and {self._waiting} requests "
+                                          f"already waiting ({self._size} in use)")
+                    remaining = start + timeout - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no database connection available after {timeout:.1f}s "
+                                          f"({self._size} in use, {self._waiting} waiting)")
+                    waited = True
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    entry = self._idle.pop()
+                else:
+                    self._size += 1 # Reserve the slot, connect outside the lock
+
+            now = time.monotonic()
+            if entry is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+            else:
+                conn, created_at, last_used = entry
+                if conn.closed or self._expired(created_at, last_used, now):
+                    self._drop(conn, "connections_recycled")
+                    continue
+                if now - last_used > self.ping_after and not self._ping(conn):
+                    self._drop(conn, "ping_failures")
+                    continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._created_at[id(conn)] = created_at
+                self._stats["acquires"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                self._stats["wait_seconds_total"] += elapsed
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], elapsed)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection: rolls back an open transaction, or closes the connection if it
+        is broken or `close` is set."""
+        with self._cond:
+            created_at = self._created_at.pop(id(conn), None)
+        if created_at is None:
+            raise PoolError("trying to put unkeyed connection")
+
+        if not close and not conn.closed:
+            try:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True # Connection lost or broken
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback() # Reset whatever the borrower left open
+            except Exception:
+                close = True
+        if close or conn.closed or self._closed:
+            self._drop(conn, "discarded")
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Closes the idle connections and refuses further use; connections in use are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of the counters plus current size, connections in use and waiting threads."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = len(self._created_at)
+            stats["waiting"] = self._waiting
+            stats["max_size"] = self.max_size
+        stats["wait_seconds_mean"] = stats["wait_seconds_total"] / stats["acquires"] if stats["acquires"] else 0.0
+        return stats
@@ -9,43 +9,77 @@ from flask_login import UserMixin # Needed for the User class
 # from dotenv import load_dotenv
 import sqlite3
 import traceback
+import time
+import threading
 import datetime # Needed for timestamps
 import random
+import difflib
+import json
+from collections import OrderedDict
+from Database.connection_pool import ConnectionPool
+from Database.snapshot_codec import chunk_content, content_digest, encode_chunk, decode_chunk, DEFAULT_CODEC
 
 # --- Configuration & Constants ---
 # load_dotenv(override=True) # Removed
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///mydatabase.db") # Default to SQLite if not set
 IS_POSTGRES = DATABASE_URL.startswith("postgres")
+# Snapshot retention defaults (per-target keep_versions/keep_days override these; 0 = no limit)
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv("SNAPSHOT_KEEP_VERSIONS", 100))
+SNAPSHOT_KEEP_DAYS = int(os.getenv("SNAPSHOT_KEEP_DAYS", 0))
+# In-process user cache for the Flask-Login user loader (0 = no caching)
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10000))
+# PostgreSQL connection pool (see Database/connection_pool.py)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30)) # Wait for a free connection before failing
+DB_POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", 100)) # Requests waiting at once; more fail right away
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PING_AFTER_SECONDS", 30)) # Check connections idle for longer
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", 600)) # Close extra connections idle for longer
+DB_POOL_MAX_LIFETIME_SECONDS = float(os.getenv("DB_POOL_MAX_LIFETIME_SECONDS", 3600)) # Replace older connections
 
 # --- Database Setup ---
 pool = None
+_pool_lock = threading.Lock()
+_sqlite_local = threading.local() # SQLite: one reused connection per thread
 
 def init_connection_pool():
     global pool
     if IS_POSTGRES and not pool:
-        # --- DEBUGGING ---
-        db_url_in_pool_init = os.getenv('DATABASE_URL') # Read it again just in case
-        print(f"DEBUG: DATABASE_URL in init_connection_pool: {db_url_in_pool_init}", flush=True)
-        # --- END DEBUGGING ---
-        try:
-            print("Initializing database connection pool...")
-            # Ensure max_connections is reasonable, e.g., 5-10 for most apps
-            # Use the locally read variable just for certainty in debugging
-            pool = psycopg2.pool.SimpleConnectionPool(1, 10, dsn=db_url_in_pool_init)
-            print("Database connection pool initialized.")
-        except psycopg2.OperationalError as e:
-            print(f"ERROR: Could not connect to PostgreSQL database: {e}", file=sys.stderr)
-            # Optionally exit or raise a custom exception if DB is critical at startup
-            # sys.exit(1)
-            pool = None # Ensure pool is None if init fails
-        except Exception as e:
-            print(f"ERROR: Unexpected error initializing connection pool: {e}", file=sys.stderr)
-            pool = None
+        with _pool_lock: # One pool, even if several threads get here first
+            if not pool:
+                _init_connection_pool()
     elif not IS_POSTGRES:
         print("Using SQLite, connection pool not applicable.")
 
+def _init_connection_pool():
+    """Creates the PostgreSQL pool (call with _pool_lock held)."""
+    global pool
+    # --- DEBUGGING ---
+    db_url_in_pool_init = os.getenv('DATABASE_URL') # Read it again just in case
+    print(f"DEBUG: DATABASE_URL in init_connection_pool: {db_url_in_pool_init}", flush=True)
+    # --- END DEBUGGING ---
+    try:
+        print("Initializing database connection pool...")
+        # Ensure max_connections is reasonable, e.g., 5-10 for most apps
+        # Use the locally read variable just for certainty in debugging
+        pool = ConnectionPool(db_url_in_pool_init, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                              timeout=DB_POOL_TIMEOUT_SECONDS, max_waiting=DB_POOL_MAX_WAITING,
+                              ping_after=DB_POOL_PING_AFTER_SECONDS,
+                              max_idle=DB_POOL_MAX_IDLE_SECONDS, max_lifetime=DB_POOL_MAX_LIFETIME_SECONDS)
+        print(f"Database connection pool initialized ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} connections).")
+    except psycopg2.OperationalError as e:
+        print(f"ERROR: Could not connect to PostgreSQL database: {e}", file=sys.stderr)
+        # Optionally exit or raise a custom exception if DB is critical at startup
+        # sys.exit(1)
+        pool = None # Ensure pool is None if init fails
+    except Exception as e:
+        print(f"ERROR: Unexpected error initializing connection pool: {e}", file=sys.stderr)
+        pool = None
+
 def get_db_connection():
-    """Gets a connection from the pool (PostgreSQL) or creates one (SQLite)."""
+    """Gets a connection from the pool (PostgreSQL, waiting up to DB_POOL_TIMEOUT_SECONDS for a free one)
+    or the calling thread's connection (SQLite)."""
     if IS_POSTGRES:
         if not pool:
             # Attempt to re-initialize if accessed before successful init or after failure
@@ -54,15 +88,31 @@ def get_db_connection():
                 raise ConnectionError("Database connection pool is not available.")
         return pool.getconn()
     else:
-        return sqlite3.connect(DATABASE_URL.split("///")[1]) # Get filename from URL
+        if getattr(_sqlite_local, 'in_use', False):
+            # Nested use on the same thread: a separate connection, closed on release
+            return sqlite3.connect(DATABASE_URL.split("///")[1])
+        if getattr(_sqlite_local, 'conn', None) is None:
+            _sqlite_local.conn = sqlite3.connect(DATABASE_URL.split("///")[1]) # Get filename from URL
+        _sqlite_local.in_use = True
+        return _sqlite_local.conn
 
 def release_db_connection(conn):
-    """Releases a connection back to the pool (PostgreSQL) or closes it (SQLite)."""
+    """Releases a connection back to the pool (PostgreSQL; an open transaction is rolled back)
+    or to its thread (SQLite)."""
     if IS_POSTGRES and pool:
         pool.putconn(conn)
+    elif conn is not None and conn is getattr(_sqlite_local, 'conn', None):
+        if conn.in_transaction:
+            conn.rollback() # Don't leak an unfinished transaction into the thread's next use
+        _sqlite_local.in_use = False
     elif conn:
         conn.close()
 
+def get_db_pool_stats():
+    """Connection pool counters: size, idle, in_use, waiting, acquires, waits, wait_seconds_*,
+    timeouts, rejected and replaced connections. None without a PostgreSQL pool."""
+    return pool.stats() if IS_POSTGRES and pool else None
+
 def close_connection_pool():
     global pool
     if IS_POSTGRES and pool:
@@ -323,6 +373,226 @@ def init_db():
                 conn.rollback()
                 raise
 
+            # --- Step 9: Monitor Targets Table (NEW) ---
+            print("Step 9: Ensuring monitor_targets table exists...")
+            try:
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS monitor_targets (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER, -- NULL for targets not owned by a specific user
+                    url TEXT NOT NULL,
+                    selector TEXT NOT NULL,
+                    interval_seconds INTEGER DEFAULT 3600 NOT NULL,
+                    is_active BOOLEAN DEFAULT TRUE NOT NULL,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    last_checked_at TIMESTAMP WITH TIME ZONE,
+                    last_status TEXT,
+                    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+                );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_monitor_targets_is_active ON monitor_targets (is_active);")
+                conn.commit()
+                print("Step 9: monitor_targets table completed.")
+            except Exception as e:
+                print(f"Monitor Targets Table Error: {e}")
+                conn.rollback()
+                raise
+
+            # --- Step 10: Snapshots & Change Events Tables (NEW) ---
+            print("Step 10: Ensuring snapshots and change_events tables exist...")
+            try:
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id SERIAL PRIMARY KEY,
+                    target_id INTEGER NOT NULL,
+                    fetched_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    content TEXT, -- Inline content; NULL for snapshots stored as chunks
+                    FOREIGN KEY(target_id) REFERENCES monitor_targets(id) ON DELETE CASCADE
+                );
+                """)
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS change_events (
+                    id SERIAL PRIMARY KEY,
+                    target_id INTEGER NOT NULL,
+                    snapshot_id INTEGER,
+                    detected_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP NOT NULL,
+                    summary TEXT,
+                    FOREIGN KEY(target_id) REFERENCES monitor_targets(id) ON DELETE CASCADE,
+                    FOREIGN KEY(snapshot_id) REFERENCES snapshots(id) ON DELETE SET NULL
+                );
+                """)
+                # Latest-snapshot lookups and history scans both walk this index
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_target_id_fetched_at ON snapshots (target_id, fetched_at DESC);")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_change_events_target_id_detected_at ON change_events (target_id, detected_at DESC);")
+                # Lookup of ad-hoc targets by URL + selector
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_monitor_targets_url_selector ON monitor_targets (url, selector);")
+                conn.commit()
+                print("Step 10: snapshots and change_events tables completed.")
+            except Exception as e:
+                print(f"Snapshots/Change Events Table Error: {e}")
+                conn.rollback()
+                raise
+
+            # --- Step 11: Monitor Target Fingerprint Columns (NEW) ---
+            # Digest + length of the latest snapshot, so "no change" checks never load content
+            print("Step 11: Ensuring monitor_targets fingerprint columns exist...")
+            fingerprint_columns = [
+                ('content_hash', 'TEXT'),
+                ('content_length', 'INTEGER')
+            ]
+            if IS_POSTGRES:
+                for col_name, col_type in fingerprint_columns:
+                    try:
+                        cur.execute(f"ALTER TABLE monitor_targets ADD COLUMN IF NOT EXISTS {col_name} {col_type};")
+                        conn.commit()
+                    except Exception as e:
+                        print(f"Error adding column {col_name}: {e}")
+                        conn.rollback()
+                        raise
+            else:
+                for col_name, col_type in fingerprint_columns:
+                    _ensure_column_exists_sqlite_safe(conn, cur, 'monitor_targets', col_name, col_type)
+            print("Step 11: monitor_targets fingerprint columns completed.")
+
+            # --- Step 12: Chunked Snapshot Store (NEW) ---
+            # Snapshot content is stored as compressed, content-addressed chunks shared between versions
+            print("Step 12: Ensuring snapshot chunk store exists...")
+            try:
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS content_chunks (
+                    hash TEXT PRIMARY KEY, -- BLAKE2b digest of the uncompressed chunk
+                    codec TEXT NOT NULL, -- 'zstd' or 'zlib'
+                    data BYTEA NOT NULL,
+                    raw_length INTEGER NOT NULL
+                );
+                """)
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS snapshot_chunks (
+                    snapshot_id INTEGER NOT NULL,
+                    seq INTEGER NOT NULL,
+                    chunk_hash TEXT NOT NULL,
+                    PRIMARY KEY (snapshot_id, seq),
+                    FOREIGN KEY(snapshot_id) REFERENCES snapshots(id) ON DELETE CASCADE,
+                    FOREIGN KEY(chunk_hash) REFERENCES content_chunks(hash)
+                );
+                """)
+                # Orphan checks after pruning look chunks up by hash
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_chunks_chunk_hash ON snapshot_chunks (chunk_hash);")
+                conn.commit()
+            except Exception as e:
+                print(f"Snapshot Chunk Store Error: {e}")
+                conn.rollback()
+                raise
+            snapshot_columns = [
+                ('content_hash', 'TEXT'),
+                ('content_length', 'INTEGER')
+            ]
+            retention_columns = [
+                ('keep_versions', 'INTEGER'), # NULL = use SNAPSHOT_KEEP_VERSIONS
+                ('keep_days', 'INTEGER') # NULL = use SNAPSHOT_KEEP_DAYS
+            ]
+            if IS_POSTGRES:
+                try:
+                    for col_name, col_type in snapshot_columns:
+                        cur.execute(f"ALTER TABLE snapshots ADD COLUMN IF NOT EXISTS {col_name} {col_type};")
+                    for col_name, col_type in retention_columns:
+                        cur.execute(f"ALTER TABLE monitor_targets ADD COLUMN IF NOT EXISTS {col_name} {col_type};")
+                    # Snapshots created before the chunk store keep their inline content
+                    cur.execute("ALTER TABLE snapshots ALTER COLUMN content DROP NOT NULL;")
+                    conn.commit()
+                except Exception as e:
+                    print(f"Error updating snapshot columns: {e}")
+                    conn.rollback()
+                    raise
+            else:
+                for col_name, col_type in snapshot_columns:
+                    _ensure_column_exists_sqlite_safe(conn, cur, 'snapshots', col_name, col_type)
+                for col_name, col_type in retention_columns:
+                    _ensure_column_exists_sqlite_safe(conn, cur, 'monitor_targets', col_name, col_type)
+            print("Step 12: snapshot chunk store completed.")
+
+            # --- Step 13: Change Event Diffs (NEW) ---
+            print("Step 13: Ensuring change_events diff column exists...")
+            if IS_POSTGRES:
+                try:
+                    cur.execute("ALTER TABLE change_events ADD COLUMN IF NOT EXISTS diff TEXT;") # Structured diff as JSON
+                    conn.commit()
+                except Exception as e:
+                    print(f"Error adding column diff: {e}")
+                    conn.rollback()
+                    raise
+            else:
+                _ensure_column_exists_sqlite_safe(conn, cur, 'change_events', 'diff', 'TEXT')
+            print("Step 13: change_events diff column completed.")
+
+            # --- Step 14: Per-Target Parser Backend (NEW) ---
+            print("Step 14: Ensuring monitor_targets parser column exists...")
+            if IS_POSTGRES:
+                try:
+                    cur.execute("ALTER TABLE monitor_targets ADD COLUMN IF NOT EXISTS parser TEXT;") # NULL = default backend
+                    conn.commit()
+                except Exception as e:
+                    print(f"Error adding column parser: {e}")
+                    conn.rollback()
+                    raise
+            else:
+                _ensure_column_exists_sqlite_safe(conn, cur, 'monitor_targets', 'parser', 'TEXT')
+            print("Step 14: monitor_targets parser column completed.")
+
+            # --- Step 15: Agency Thread IDs per Conversation (NEW) ---
+            print("Step 15: Ensuring conversations thread_ids column exists...")
+            if IS_POSTGRES:
+                try:
+                    cur.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS thread_ids TEXT;") # JSON, Agency threads_callbacks format
+                    conn.commit()
+                except Exception as e:
+                    print(f"Error adding column thread_ids: {e}")
+                    conn.rollback()
+                    raise
+            else:
+                _ensure_column_exists_sqlite_safe(conn, cur, 'conversations', 'thread_ids', 'TEXT')
+            print("Step 15: conversations thread_ids column completed.")
+
+            # --- Step 16: Token Usage per Conversation (NEW) ---
+            print("Step 16: Ensuring conversations token usage columns exist...")
+            usage_columns = [('prompt_tokens', 'INTEGER DEFAULT 0'), ('completion_tokens', 'INTEGER DEFAULT 0')]
+            if IS_POSTGRES:
+                try:
+                    for col_name, col_type in usage_columns:
+                        cur.execute(f"ALTER TABLE conversations ADD COLUMN IF NOT EXISTS {col_name} {col_type};")
+                    conn.commit()
+                except Exception as e:
+                    print(f"Error adding token usage columns: {e}")
+                    conn.rollback()
+                    raise
+            else:
+                for col_name, col_type in usage_columns:
+                    _ensure_column_exists_sqlite_safe(conn, cur, 'conversations', col_name, col_type)
+            print("Step 16: conversations token usage columns completed.")
+
+            # --- Step 17: One Ad-hoc Target per URL + Selector (NEW) ---
+            # Concurrent checks of a new URL + selector could each create a target; the unique index
+            # lets get_or_create_monitor_target insert with ON CONFLICT DO NOTHING instead
+            print("Step 17: Ensuring ad-hoc monitor targets are unique per URL + selector...")
+            try:
+                # Keep the oldest of any duplicates (the one lookups already returned)
+                cur.execute("""
+                    DELETE FROM monitor_targets WHERE user_id IS NULL AND EXISTS (
+                        SELECT 1 FROM monitor_targets t
+                        WHERE t.user_id IS NULL AND t.url = monitor_targets.url
+                          AND t.selector = monitor_targets.selector AND t.id < monitor_targets.id);
+                """)
+                if cur.rowcount and cur.rowcount > 0:
+                    print(f"  Removed {cur.rowcount} duplicate ad-hoc monitor target(s).")
+                cur.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_monitor_targets_adhoc_url_selector
+                               ON monitor_targets (url, selector) WHERE user_id IS NULL;""")
+                conn.commit()
+            except Exception as e:
+                print(f"Error creating unique index on ad-hoc monitor targets: {e}")
+                conn.rollback()
+                raise
+            print("Step 17: ad-hoc monitor targets unique index completed.")
+
             print("Database schema initialization/migration complete.")
 
     except Exception as e:
@@ -453,6 +723,50 @@ def get_user_by_id(user_id):
     finally:
         release_db_connection(conn)
 
+# --- User Cache (NEW) ---
+# The Flask-Login user loader runs on every authenticated request. Users are cached per process
+# for USER_CACHE_TTL_SECONDS: the write functions below drop their user's entry, and the TTL bounds
+# how long writes made by other processes go unseen. Token counters change with every chat turn,
+# so they are not cached (read them with get_user_token_details()).
+_user_cache = OrderedDict() # user_id -> (expires_at (monotonic), User keyword arguments); oldest first
+_user_cache_lock = threading.Lock()
+_user_cache_version = 0 # Bumped by every invalidation, so a load racing with a write is not cached
+
+def get_cached_user(user_id):
+    """Returns the User with user_id (None if there is none), from the cache while it is fresh.
+    tokens_used and last_token_reset are None on the returned User."""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None and entry[0] > now:
+            _user_cache.move_to_end(user_id)
+            return User(**entry[1])
+        version = _user_cache_version
+
+    db_user = get_user_by_id(user_id)
+    if not db_user:
+        return None
+    # Indices: 0:id, 1:username, 2:pwd_hash, 3:google_id, 4:tokens, 5:subscribed, 6:last_reset
+    #          7:first_name, 8:last_name, 9:email, 10:is_verified
+    fields = dict(id=db_user[0], username=db_user[1], password_hash=db_user[2], google_id=db_user[3],
+                  tokens_used=None, is_subscribed=db_user[5], last_token_reset=None,
+                  first_name=db_user[7], last_name=db_user[8], email=db_user[9], is_verified=db_user[10])
+    if USER_CACHE_TTL_SECONDS > 0:
+        with _user_cache_lock:
+            if version == _user_cache_version:
+                _user_cache[user_id] = (now + USER_CACHE_TTL_SECONDS, fields)
+                _user_cache.move_to_end(user_id)
+                while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+                    _user_cache.popitem(last=False)
+    return User(**fields)
+
+def invalidate_cached_user(user_id):
+    """Drops a user's cache entry (call after changing the user's row)."""
+    global _user_cache_version
+    with _user_cache_lock:
+        _user_cache_version += 1
+        _user_cache.pop(user_id, None)
+
 # NEW function to get user by email
 def get_user_by_email(email):
     if not email: return None
@@ -558,44 +872,145 @@ def update_token_usage(user_id, tokens_increment):
     finally:
         release_db_connection(conn)
 
+# --- Chat Request Unit of Work (NEW) ---
+
+class ChatUnitOfWork:
+    """One pooled connection and one transaction for the statements of one phase of a chat request.
+
+    Commits when the block exits normally, rolls back if it raises, and releases the
+    connection either way. A chat turn uses one before the agency runs and one after it,
+    so no connection is held while the agents wait on the API:
+
+        with ChatUnitOfWork() as uow:
+            token_details = uow.reserve_tokens(user_id, reset_interval, token_limit, reserve)
+            conversation_id = uow.create_conversation(user_id)
+            uow.add_message(user_id, conversation_id, 'user', message)
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.cur = None
+
+    def __enter__(self):
+        self.conn = get_db_connection()
+        if not self.conn:
+            raise ConnectionError("Could not get a database connection.")
+        self.cur = self.conn.cursor()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            try:
+                self.cur.close()
+            finally:
+                release_db_connection(self.conn)
+        return False # Re-raise errors from the block
+
+    def reserve_tokens(self, user_id, reset_interval, token_limit, reserve):
+        """Quota check-and-consume for a free-tier turn in one conditional statement: resets the
+        user's token counter if `reset_interval` (a timedelta) has passed since the last reset and,
+        if the user is under `token_limit`, adds `reserve` tokens to it. Concurrent requests of the
+        same user serialize on the row, so each one sees the others' reservations.
+
+        Returns a dict (tokens_used, is_subscribed, last_token_reset, was_reset, limit_reached,
+        reserved, reserved_at), or None if the user does not exist. Subscribed users are never
+        limited and reserve nothing. Settle the reservation with settle_tokens().
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cutoff = now - reset_interval
+        subscribed = "COALESCE(is_subscribed, FALSE)"
+        reset_due = f"(NOT {subscribed} AND (last_token_reset IS NULL OR last_token_reset <= %s))"
+        current = f"(CASE WHEN {reset_due} THEN 0 ELSE tokens_used END)" # Counter after a due reset
+        self.cur.execute(f"""
+            UPDATE users
+            SET tokens_used = CASE WHEN {subscribed} THEN tokens_used ELSE {current} + %s END,
+                last_token_reset = CASE WHEN {reset_due} THEN %s ELSE last_token_reset END
+            WHERE id = %s AND ({subscribed} OR {current} < %s)
+            RETURNING tokens_used, is_subscribed, last_token_reset, last_token_reset = %s
+        """, (cutoff, reserve, cutoff, now, user_id, cutoff, token_limit, now))
+        result = self.cur.fetchone()
+        if result:
+            is_subscribed = bool(result[1])
+            return {"tokens_used": result[0], "is_subscribed": is_subscribed, "last_token_reset": result[2],
+                    "was_reset": bool(result[3]), "limit_reached": False,
+                    "reserved": 0 if is_subscribed else reserve, "reserved_at": now}
+
+        # No row updated: the user is at the limit (or does not exist)
+        self.cur.execute("SELECT tokens_used, is_subscribed, last_token_reset FROM users WHERE id = %s", (user_id,))
+        result = self.cur.fetchone()
+        if not result:
+            return None
+        return {"tokens_used": result[0], "is_subscribed": bool(result[1]), "last_token_reset": result[2],
+                "was_reset": False, "limit_reached": True, "reserved": 0, "reserved_at": now}
+
+    def settle_tokens(self, user_id, reserved, reserved_at, tokens_used):
+        """Replaces a reservation made by reserve_tokens() with the tokens actually used (0 releases it).
+        If the counter was reset since the reservation, the reservation is gone and only the usage is added."""
+        self.cur.execute("""
+            UPDATE users
+            SET tokens_used = tokens_used + CASE WHEN last_token_reset <= %s THEN %s ELSE %s END
+            WHERE id = %s
+        """, (reserved_at, tokens_used - reserved, tokens_used, user_id))
+
+    def create_conversation(self, user_id, title=None):
+        """Creates a conversation (titled "Chat N" unless a title is given, N counted in the same
+        statement) and returns its ID."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.cur.execute("""
+            INSERT INTO conversations (user_id, title, created_at, last_updated_at)
+            SELECT %s, COALESCE(%s, 'Chat ' || COUNT(*)), %s, %s FROM conversations WHERE user_id = %s
+            RETURNING id, title
+        """, (user_id, title, now, now, user_id))
+        new_conversation_id, title = self.cur.fetchone()
+        print(f"Created conversation {new_conversation_id} ('{title}') for user {user_id}")
+        return new_conversation_id
+
+    def add_message(self, user_id, conversation_id, role, content, prompt_tokens=0, completion_tokens=0):
+        """Adds a message to one of the user's conversations, bumping the conversation's last_updated_at
+        and adding token usage to its totals. Returns the message ID, or None if the user does not own
+        the conversation (nothing is written then)."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        touch_sql = """
+            UPDATE conversations
+            SET last_updated_at = %s,
+                prompt_tokens = COALESCE(prompt_tokens, 0) + %s,
+                completion_tokens = COALESCE(completion_tokens, 0) + %s
+            WHERE id = %s AND user_id = %s
+        """
+        touch_params = (now, prompt_tokens, completion_tokens, conversation_id, user_id)
+        if IS_POSTGRES:
+            # Ownership check, timestamp bump and insert in one statement
+            self.cur.execute(f"""
+                WITH touched AS ({touch_sql} RETURNING id)
+                INSERT INTO chat_history (user_id, conversation_id, role, content, timestamp)
+                SELECT %s, id, %s, %s, %s FROM touched
+                RETURNING id
+            """, touch_params + (user_id, role, content, now))
+            result = self.cur.fetchone()
+            return result[0] if result else None
+        # SQLite has no data-modifying CTEs: two statements on the same connection
+        self.cur.execute(touch_sql, touch_params)
+        if self.cur.rowcount == 0:
+            return None
+        self.cur.execute("INSERT INTO chat_history (user_id, conversation_id, role, content, timestamp) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                         (user_id, conversation_id, role, content, now))
+        return self.cur.fetchone()[0]
+
 # --- Conversation Management Functions (NEW) ---
 
 def create_conversation(user_id, title=None):
     """Creates a new conversation for a user and returns its ID."""
-    conn = get_db_connection()
-    if not conn:
-        print("ERROR: Could not get DB connection to create conversation.", file=sys.stderr)
-        return None
-    
-    # Generate automatic title like "Chat N"
-    if not title:
-        try:
-            with conn.cursor() as cur:
-                # Count existing conversations for this user to determine next number
-                cur.execute("SELECT COUNT(*) FROM conversations WHERE user_id = %s", (user_id,))
-                count = cur.fetchone()[0]
-                title = f"Chat {count}"
-        except Exception as e:
-            print(f"Error counting conversations for user {user_id} to generate title: {e}")
-            # Fallback title if count fails
-            title = f"Chat from {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-
-    sql = "INSERT INTO conversations (user_id, title, created_at, last_updated_at) VALUES (%s, %s, %s, %s) RETURNING id"
-    now = datetime.datetime.now(datetime.timezone.utc)
     try:
-        with conn.cursor() as cur:
-            cur.execute(sql, (user_id, title, now, now))
-            new_conversation_id = cur.fetchone()[0]
-            conn.commit()
-            print(f"Created conversation {new_conversation_id} ('{title}') for user {user_id}")
-            return new_conversation_id
+        with ChatUnitOfWork() as uow:
+            return uow.create_conversation(user_id, title)
     except Exception as e:
         print(f"Error creating conversation for user {user_id}: {e}", file=sys.stderr)
-        conn.rollback()
         return None
-    finally:
-        if conn:
-            release_db_connection(conn)
 
 def get_conversations_for_user(user_id):
     """Retrieves all conversations for a user, ordered by last updated."""
@@ -690,75 +1105,105 @@ def delete_conversation(conversation_id, user_id):
         if conn:
             release_db_connection(conn)
 
-# --- Chat History Functions (Modified) ---
-
-def add_chat_message(user_id, conversation_id, role, content):
-    """Adds a message to the chat history for a specific conversation."""
+def get_conversation_threads(conversation_id):
+    """Returns the saved agency thread IDs of a conversation
+    ({"main_thread": id, agent_name: {recipient_name: id}}), or None if none were saved."""
     conn = get_db_connection()
     if not conn:
-        print("ERROR: Could not get DB connection to add chat message.", file=sys.stderr)
-        return False
+        print("ERROR: Could not get DB connection to get conversation threads.", file=sys.stderr)
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT thread_ids FROM conversations WHERE id = %s", (conversation_id,))
+            row = cur.fetchone()
+            if row and row[0]:
+                return json.loads(row[0])
+            return None
+    except Exception as e:
+        print(f"Error fetching thread IDs for conversation {conversation_id}: {e}", file=sys.stderr)
+        return None # The agency then starts with new threads
+    finally:
+        if conn:
+            release_db_connection(conn)
 
-    # Ensure conversation_id is not None before inserting
-    if conversation_id is None:
-        print(f"ERROR: Attempted to add chat message with conversation_id=None for user {user_id}", file=sys.stderr)
+def save_conversation_threads(conversation_id, thread_ids):
+    """Saves the agency thread IDs of a conversation (format of get_conversation_threads)."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to save conversation threads.", file=sys.stderr)
         return False
-
-    # Also update the conversation's last_updated_at timestamp
-    if not update_conversation_timestamp(conversation_id):
-        print(f"Warning: Failed to update timestamp for conversation {conversation_id} when adding message.", file=sys.stderr)
-        # Continue adding the message anyway? Or return False? Let's continue for now.
-
-    # Modified SQL to include conversation_id
-    sql = "INSERT INTO chat_history (user_id, conversation_id, role, content, timestamp) VALUES (%s, %s, %s, %s, %s)"
-    timestamp = datetime.datetime.now(datetime.timezone.utc)
     try:
         with conn.cursor() as cur:
-            # Pass conversation_id to execute
-            cur.execute(sql, (user_id, conversation_id, role, content, timestamp))
+            cur.execute("UPDATE conversations SET thread_ids = %s WHERE id = %s",
+                        (json.dumps(thread_ids), conversation_id))
             conn.commit()
             return True
     except Exception as e:
-        print(f"Error adding chat message for user {user_id}, convo {conversation_id}: {e}", file=sys.stderr)
+        print(f"Error saving thread IDs for conversation {conversation_id}: {e}", file=sys.stderr)
         conn.rollback()
         return False
     finally:
         if conn:
             release_db_connection(conn)
 
-# Modified get_chat_history to fetch by conversation_id
-def get_chat_history(conversation_id, limit=100): # Increased limit slightly
-    """Retrieves the most recent chat messages for a specific conversation."""
-    conn = get_db_connection()
-    if not conn:
-        print("ERROR: Could not get DB connection to get chat history.", file=sys.stderr)
-        return []
+# --- Chat History Functions (Modified) ---
+
+def add_chat_message(user_id, conversation_id, role, content):
+    """Adds a message to the chat history for a specific conversation (and updates its timestamp)."""
+    # Ensure conversation_id is not None before inserting
+    if conversation_id is None:
+        print(f"ERROR: Attempted to add chat message with conversation_id=None for user {user_id}", file=sys.stderr)
+        return False
+    try:
+        with ChatUnitOfWork() as uow:
+            if uow.add_message(user_id, conversation_id, role, content) is None:
+                print(f"Error adding chat message: conversation {conversation_id} does not belong to user {user_id}", file=sys.stderr)
+                return False
+            return True
+    except Exception as e:
+        print(f"Error adding chat message for user {user_id}, convo {conversation_id}: {e}", file=sys.stderr)
+        return False
 
+# Keyset-paginated chat history (newest first)
+def get_chat_history(conversation_id, limit=50, before_id=None, roles=None):
+    """Retrieves one page of a conversation's messages, newest first.
+
+    Returns up to `limit` dicts (id, role, content, timestamp) older than the message
+    `before_id` (the last id of the previous page), or the newest ones if before_id is
+    None. `roles` restricts the page to those roles. The page is one range scan of the
+    (conversation_id, timestamp) index, however long the conversation is.
+    """
     # Ensure conversation_id is valid
     if conversation_id is None:
         print("ERROR: get_chat_history called with conversation_id=None.", file=sys.stderr)
         return []
 
-    # Fetch role, content, timestamp - Filter by conversation_id
-    # Removed user_id check here - ownership should be checked before calling this
-    # NOTE: If using SQLite, placeholders might need to be '?' instead of '%s'
-    sql = "SELECT id, user_id, conversation_id, role, content, timestamp FROM chat_history WHERE conversation_id = %s ORDER BY timestamp ASC LIMIT %s"
-    messages = []
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get chat history.", file=sys.stderr)
+        return []
+
+    # Ownership should be checked before calling this
+    # Messages of one transaction share their timestamp, so (timestamp, id) is the sort key and cursor
+    params = []
+    sql = "SELECT h.id, h.role, h.content, h.timestamp FROM chat_history h"
+    if before_id is not None:
+        sql += " JOIN chat_history c ON c.id = %s AND c.conversation_id = h.conversation_id"
+        params.append(before_id)
+    sql += " WHERE h.conversation_id = %s"
+    params.append(conversation_id)
+    if before_id is not None:
+        sql += " AND h.timestamp <= c.timestamp AND (h.timestamp < c.timestamp OR h.id < c.id)"
+    if roles:
+        sql += f" AND h.role IN ({', '.join(['%s'] * len(roles))})"
+        params.extend(roles)
+    sql += " ORDER BY h.timestamp DESC, h.id DESC LIMIT %s"
+    params.append(limit)
     try:
         with conn.cursor() as cur:
-            cur.execute(sql, (conversation_id, limit))
-            # Fetchall returns list of tuples
-            results = cur.fetchall()
-            # Convert to list of dicts for easier template use
-            # Keep ascending order as set in SQL
-            for row in results:
-                # Matching the expected tuple structure for template: (id, user_id, role, content, timestamp)
-                # The template currently uses message[2] for role, message[3] for content.
-                # Let's pass the full tuple to match the template's expectation for now.
-                # A better approach would be to return dicts and update the template.
-                 messages.append(row) # Pass the raw tuple
-                # messages.append({'id': row[0], 'user_id': row[1], 'conversation_id': row[2], 'role': row[3], 'content': row[4], 'timestamp': row[5]})
-            return messages
+            cur.execute(sql, params)
+            return [{'id': row[0], 'role': row[1], 'content': row[2], 'timestamp': row[3]}
+                    for row in cur.fetchall()]
     except Exception as e:
         print(f"Error fetching chat history for conversation {conversation_id}: {e}", file=sys.stderr)
         return [] # Return empty list on error
@@ -778,6 +1223,7 @@ def set_user_subscription(user_id, status):
         with conn.cursor() as cur:
             cur.execute(sql, (status, user_id))
             conn.commit()
+            invalidate_cached_user(user_id)
             print(f"Subscription status for user {user_id} set to {status}.")
             return True
     except Exception as e:
@@ -817,6 +1263,7 @@ def update_username(user_id, new_username):
         with conn.cursor() as cur:
             cur.execute(sql, (new_username.strip(), user_id))
             conn.commit()
+            invalidate_cached_user(user_id)
             print(f"Username updated for user {user_id}.")
             return True
     except (psycopg2.IntegrityError, sqlite3.IntegrityError) as e: # Catch unique constraint violation
@@ -847,6 +1294,7 @@ def update_password_hash(user_id, new_password_hash):
         with conn.cursor() as cur:
             cur.execute(sql, (new_password_hash, user_id))
             conn.commit()
+            invalidate_cached_user(user_id)
             print(f"Password updated for user {user_id}.")
             return True
     except Exception as e:
@@ -914,6 +1362,7 @@ def verify_user(user_id):
         with conn.cursor() as cur:
             cur.execute(sql, (user_id,))
             conn.commit()
+            invalidate_cached_user(user_id)
             print(f"Verified user {user_id}.")
             return True
     except Exception as e:
@@ -921,4 +1370,381 @@ def verify_user(user_id):
         conn.rollback()
         return False
     finally:
-        release_db_connection(conn) 
\ No newline at end of file
+        release_db_connection(conn) 
+
+# --- Monitor Target Functions (NEW) ---
+
+def add_monitor_target(url, selector, interval_seconds=3600, user_id=None, parser=None):
+    """Adds a monitoring target (URL + CSS selector checked every interval_seconds). Returns its ID.
+
+    parser optionally pins the HTML parser backend for this target (see ExtractContentTool).
+    """
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to add monitor target.", file=sys.stderr)
+        return None
+    sql = "INSERT INTO monitor_targets (user_id, url, selector, interval_seconds, parser) VALUES (%s, %s, %s, %s, %s) RETURNING id"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (user_id, url, selector, interval_seconds, parser))
+            new_target_id = cur.fetchone()[0]
+            conn.commit()
+            print(f"Added monitor target {new_target_id} for {url} ('{selector}', every {interval_seconds}s)")
+            return new_target_id
+    except Exception as e:
+        print(f"Error adding monitor target for {url}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_active_monitor_targets():
+    """Retrieves all active monitoring targets as a list of dicts."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get monitor targets.", file=sys.stderr)
+        return []
+    sql = """SELECT id, user_id, url, selector, interval_seconds, last_checked_at, parser
+             FROM monitor_targets WHERE is_active = TRUE"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            return [{'id': row[0], 'user_id': row[1], 'url': row[2], 'selector': row[3],
+                     'interval_seconds': row[4], 'last_checked_at': row[5], 'parser': row[6]}
+                    for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error fetching monitor targets: {e}", file=sys.stderr)
+        return []
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def record_monitor_check(target_id, status):
+    """Stores the time and outcome ('changed', 'unchanged', 'not_modified', 'error') of a target's last check."""
+    conn = get_db_connection()
+    if not conn:
+        print(f"ERROR: Could not get DB connection to record check for monitor target {target_id}.", file=sys.stderr)
+        return False
+    sql = "UPDATE monitor_targets SET last_checked_at = %s, last_status = %s WHERE id = %s"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (now, status, target_id))
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"Error recording check for monitor target {target_id}: {e}", file=sys.stderr)
+        conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_or_create_monitor_target(url, selector, user_id=None):
+    """Returns the ID of the target for a URL + selector, creating an inactive one if none exists.
+
+    Targets created here come from ad-hoc checks (e.g. through the chat) and are
+    not picked up by the scheduler until they are activated. Concurrent calls for
+    the same URL + selector get the same target (unique index on ad-hoc targets).
+    """
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to look up monitor target.", file=sys.stderr)
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM monitor_targets WHERE url = %s AND selector = %s ORDER BY id LIMIT 1",
+                        (url, selector))
+            row = cur.fetchone()
+            if row:
+                return row[0]
+            cur.execute("""INSERT INTO monitor_targets (user_id, url, selector, is_active)
+                           VALUES (%s, %s, %s, FALSE)
+                           ON CONFLICT (url, selector) WHERE user_id IS NULL DO NOTHING
+                           RETURNING id""", (user_id, url, selector))
+            row = cur.fetchone()
+            conn.commit()
+            if row is None: # Created by a concurrent check in the meantime
+                cur.execute("SELECT id FROM monitor_targets WHERE url = %s AND selector = %s ORDER BY id LIMIT 1",
+                            (url, selector))
+                return cur.fetchone()[0]
+            print(f"Created monitor target {row[0]} for {url} ('{selector}')")
+            return row[0]
+    except Exception as e:
+        print(f"Error looking up monitor target for {url} ('{selector}'): {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_target_fingerprint(target_id):
+    """Returns (content_hash, content_length) of a target's latest snapshot, or None if not recorded yet."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get target fingerprint.", file=sys.stderr)
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT content_hash, content_length FROM monitor_targets WHERE id = %s", (target_id,))
+            row = cur.fetchone()
+            if row and row[0] is not None:
+                return row[0], row[1]
+            return None
+    except Exception as e:
+        print(f"Error fetching fingerprint for target {target_id}: {e}", file=sys.stderr)
+        return None # Callers fall back to a full content comparison
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def set_target_fingerprint(target_id, content_hash, content_length):
+    """Records the fingerprint of a target's latest snapshot (used to backfill older targets)."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to set target fingerprint.", file=sys.stderr)
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("UPDATE monitor_targets SET content_hash = %s, content_length = %s WHERE id = %s",
+                        (content_hash, content_length, target_id))
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"Error setting fingerprint for target {target_id}: {e}", file=sys.stderr)
+        conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+# --- Snapshot & Change Event Functions (NEW) ---
+
+def _write_snapshot_chunks(cur, snapshot_id, content):
+    """Stores content as chunks of a snapshot, compressing only chunks not already in the store.
+
+    On PostgreSQL the reused chunks are locked (FOR KEY SHARE) until the snapshot is
+    committed, so prune_snapshots can't delete them in between; it skips locked chunks.
+    """
+    chunks = chunk_content(content)
+    hashes = [content_digest(chunk) for chunk in chunks]
+    unique = dict(zip(hashes, chunks))
+    existing = set()
+    if unique:
+        placeholders = ', '.join(['%s'] * len(unique))
+        lock = " FOR KEY SHARE" if IS_POSTGRES else "" # SQLite serializes writers anyway
+        cur.execute(f"SELECT hash FROM content_chunks WHERE hash IN ({placeholders}){lock}", tuple(unique))
+        existing = {row[0] for row in cur.fetchall()}
+    for chunk_hash, chunk in unique.items():
+        if chunk_hash not in existing:
+            cur.execute("INSERT INTO content_chunks (hash, codec, data, raw_length) VALUES (%s, %s, %s, %s) "
+                        "ON CONFLICT (hash) DO NOTHING",
+                        (chunk_hash, DEFAULT_CODEC, encode_chunk(chunk), len(chunk)))
+    for seq, chunk_hash in enumerate(hashes):
+        cur.execute("INSERT INTO snapshot_chunks (snapshot_id, seq, chunk_hash) VALUES (%s, %s, %s)",
+                    (snapshot_id, seq, chunk_hash))
+
+def _read_snapshot_content(cur, snapshot_id, inline_content):
+    """Rebuilds a snapshot's content from its chunks (or returns the inline content of older snapshots)."""
+    if inline_content is not None:
+        return inline_content
+    cur.execute("""
+        SELECT c.codec, c.data FROM snapshot_chunks sc
+        JOIN content_chunks c ON c.hash = sc.chunk_hash
+        WHERE sc.snapshot_id = %s ORDER BY sc.seq
+    """, (snapshot_id,))
+    return ''.join(decode_chunk(data, codec) for codec, data in cur.fetchall())
+
+def get_latest_snapshot(target_id):
+    """Retrieves the most recent snapshot of a target as a dict, or None if it has none."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get latest snapshot.", file=sys.stderr)
+        return None
+    sql = "SELECT id, fetched_at, content FROM snapshots WHERE target_id = %s ORDER BY fetched_at DESC LIMIT 1"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (target_id,))
+            row = cur.fetchone()
+            if row:
+                return {'id': row[0], 'fetched_at': row[1], 'content': _read_snapshot_content(cur, row[0], row[2])}
+            return None
+    except Exception as e:
+        print(f"Error fetching latest snapshot for target {target_id}: {e}", file=sys.stderr)
+        raise # Callers must not mistake a DB error for "no previous snapshot"
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_snapshot(snapshot_id):
+    """Retrieves any stored version by snapshot ID as a dict (id, target_id, fetched_at, content), or None."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get snapshot.", file=sys.stderr)
+        return None
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, target_id, fetched_at, content FROM snapshots WHERE id = %s", (snapshot_id,))
+            row = cur.fetchone()
+            if row:
+                return {'id': row[0], 'target_id': row[1], 'fetched_at': row[2],
+                        'content': _read_snapshot_content(cur, row[0], row[3])}
+            return None
+    except Exception as e:
+        print(f"Error fetching snapshot {snapshot_id}: {e}", file=sys.stderr)
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_snapshot_diff(old_snapshot_id, new_snapshot_id):
+    """Returns a unified diff between two stored versions, or None if either version is missing."""
+    old = get_snapshot(old_snapshot_id)
+    new = get_snapshot(new_snapshot_id)
+    if old is None or new is None:
+        return None
+    diff = difflib.unified_diff(old['content'].splitlines(keepends=True), new['content'].splitlines(keepends=True),
+                                fromfile=f"snapshot {old['id']} ({old['fetched_at']})",
+                                tofile=f"snapshot {new['id']} ({new['fetched_at']})")
+    return ''.join(diff)
+
+def add_snapshot(target_id, content, change_summary=None, content_hash=None, change_diff=None):
+    """Stores a new snapshot and, if change_summary is given, the change event for it. Returns the snapshot ID.
+
+    change_diff (a structured diff, see WebsiteMonitor/tools/content_diff.py) is stored with the change event as JSON.
+
+    Content goes to the chunk store, so versions share their unchanged parts. The
+    snapshot's digest (content_hash, computed if not given) becomes the target's
+    fingerprint in the same transaction.
+    """
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to add snapshot.", file=sys.stderr)
+        return None
+    if content_hash is None:
+        content_hash = content_digest(content)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO snapshots (target_id, fetched_at, content_hash, content_length) VALUES (%s, %s, %s, %s) RETURNING id",
+                        (target_id, now, content_hash, len(content)))
+            snapshot_id = cur.fetchone()[0]
+            _write_snapshot_chunks(cur, snapshot_id, content)
+            if change_summary is not None:
+                cur.execute("INSERT INTO change_events (target_id, snapshot_id, detected_at, summary, diff) VALUES (%s, %s, %s, %s, %s)",
+                            (target_id, snapshot_id, now, change_summary,
+                             json.dumps(change_diff) if change_diff is not None else None))
+            cur.execute("UPDATE monitor_targets SET content_hash = %s, content_length = %s WHERE id = %s",
+                        (content_hash, len(content), target_id))
+            conn.commit() # Snapshot, chunks, change event and fingerprint are stored together or not at all
+            return snapshot_id
+    except Exception as e:
+        print(f"Error adding snapshot for target {target_id}: {e}", file=sys.stderr)
+        conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def prune_snapshots(target_id):
+    """Applies the target's retention policy (keep N versions and/or keep T days). Returns the number of snapshots removed.
+
+    The latest snapshot is always kept. Chunks no longer used by any snapshot are deleted.
+    """
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to prune snapshots.", file=sys.stderr)
+        return 0
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT keep_versions, keep_days FROM monitor_targets WHERE id = %s", (target_id,))
+            row = cur.fetchone()
+            keep_versions = row[0] if row and row[0] is not None else SNAPSHOT_KEEP_VERSIONS
+            keep_days = row[1] if row and row[1] is not None else SNAPSHOT_KEEP_DAYS
+            if not keep_versions and not keep_days:
+                return 0
+
+            cur.execute("SELECT id, fetched_at FROM snapshots WHERE target_id = %s ORDER BY fetched_at DESC, id DESC", (target_id,))
+            rows = cur.fetchall()
+            cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=keep_days) if keep_days else None
+            expired = []
+            for position, (snapshot_id, fetched_at) in enumerate(rows):
+                if position == 0:
+                    continue # Never drop the baseline for the next comparison
+                if isinstance(fetched_at, str): # SQLite returns timestamps as text
+                    fetched_at = datetime.datetime.fromisoformat(fetched_at)
+                if fetched_at.tzinfo is None:
+                    fetched_at = fetched_at.replace(tzinfo=datetime.timezone.utc)
+                if (keep_versions and position >= keep_versions) or (cutoff and fetched_at < cutoff):
+                    expired.append(snapshot_id)
+            if not expired:
+                return 0
+
+            placeholders = ', '.join(['%s'] * len(expired))
+            cur.execute(f"SELECT DISTINCT chunk_hash FROM snapshot_chunks WHERE snapshot_id IN ({placeholders})", tuple(expired))
+            candidate_hashes = [r[0] for r in cur.fetchall()]
+            cur.execute(f"DELETE FROM snapshot_chunks WHERE snapshot_id IN ({placeholders})", tuple(expired))
+            cur.execute(f"DELETE FROM snapshots WHERE id IN ({placeholders})", tuple(expired))
+            if candidate_hashes:
+                # Only chunks of the removed versions can have become orphans. Chunks locked by a
+                # snapshot being written (see _write_snapshot_chunks) are skipped: they are about to be
+                # referenced again.
+                hash_placeholders = ', '.join(['%s'] * len(candidate_hashes))
+                skip_locked = " FOR UPDATE SKIP LOCKED" if IS_POSTGRES else ""
+                cur.execute(f"""
+                    DELETE FROM content_chunks WHERE hash IN (
+                        SELECT hash FROM content_chunks WHERE hash IN ({hash_placeholders})
+                        AND NOT EXISTS (SELECT 1 FROM snapshot_chunks sc WHERE sc.chunk_hash = content_chunks.hash)
+                        {skip_locked})
+                """, tuple(candidate_hashes))
+            conn.commit()
+            print(f"Pruned {len(expired)} old snapshot(s) of target {target_id}.")
+            return len(expired)
+    except Exception as e:
+        print(f"Error pruning snapshots for target {target_id}: {e}", file=sys.stderr)
+        conn.rollback()
+        return 0
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_snapshots_for_target(target_id, limit=20):
+    """Retrieves the most recent snapshots (without content) of a target, newest first."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get snapshots.", file=sys.stderr)
+        return []
+    sql = ("SELECT id, fetched_at, COALESCE(content_length, LENGTH(content)), content_hash FROM snapshots "
+           "WHERE target_id = %s ORDER BY fetched_at DESC LIMIT %s")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (target_id, limit))
+            return [{'id': row[0], 'fetched_at': row[1], 'content_length': row[2], 'content_hash': row[3]}
+                    for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error fetching snapshots for target {target_id}: {e}", file=sys.stderr)
+        return []
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_change_events_for_target(target_id, limit=20):
+    """Retrieves the most recent change events of a target (with their structured diff), newest first."""
+    conn = get_db_connection()
+    if not conn:
+        print("ERROR: Could not get DB connection to get change events.", file=sys.stderr)
+        return []
+    sql = "SELECT id, snapshot_id, detected_at, summary, diff FROM change_events WHERE target_id = %s ORDER BY detected_at DESC LIMIT %s"
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, (target_id, limit))
+            return [{'id': row[0], 'snapshot_id': row[1], 'detected_at': row[2], 'summary': row[3],
+                     'diff': json.loads(row[4]) if row[4] else None}
+                    for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error fetching change events for target {target_id}: {e}", file=sys.stderr)
+        return []
+    finally:
+        if conn:
+            release_db_connection(conn)
@@ -0,0 +1,85 @@
+# Database/snapshot_codec.py
+"""Chunking, hashing and compression for the snapshot store.
+
+Snapshot content is split into content-defined chunks at word boundaries chosen
+by a rolling hash over the last few words, so an edit in one part of a page only
+changes the chunks around it: after it, boundaries fall on the same words again
+(lines would not do, extracted content can be one long line). Chunks are
+addressed by their BLAKE2b digest and stored compressed once; consecutive
+versions of a page share all unchanged chunks.
+
+zstd is used when the optional `zstandard` package is installed, zlib otherwise.
+The codec is recorded per chunk, so both can be read back.
+"""
+import re
+import zlib
+import hashlib
+from collections import deque
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Configuration & Constants ---
+MIN_CHUNK_CHARS = 1024 # No boundary before this many characters
+MAX_CHUNK_CHARS = 16384 # Forced boundary (also splits very long words)
+HASH_WINDOW_WORDS = 4 # The boundary hash covers this many words, ending with the candidate one
+BOUNDARY_MASK = 0xFF # A word ends a chunk when crc32(window) & mask == 0 (about every 256th word)
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+DEFAULT_CODEC = 'zstd' if zstandard else 'zlib'
+
+def content_digest(text):
+    """BLAKE2b digest (hex) of a string. Used for chunk addresses and content fingerprints."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=32).hexdigest()
+
+_WORD_RE = re.compile(r'\S+\s*|\s+') # Words with their trailing whitespace (leading whitespace on its own)
+
+def _words(text):
+    for match in _WORD_RE.finditer(text):
+        word = match.group()
+        for start in range(0, len(word), MAX_CHUNK_CHARS): # Very long words are cut into fixed pieces
+            yield word[start:start + MAX_CHUNK_CHARS]
+
+def chunk_content(text):
+    """Splits text into content-defined chunks. Joining the chunks gives back the text."""
+    chunks = []
+    current = []
+    size = 0
+    window = deque(maxlen=HASH_WINDOW_WORDS)
+    for word in _words(text):
+        current.append(word)
+        size += len(word)
+        window.append(word.rstrip())
+        # The boundary depends only on the last few words, so inserts/deletes don't shift later chunks
+        at_boundary = (size >= MIN_CHUNK_CHARS
+                       and (zlib.crc32(' '.join(window).encode('utf-8')) & BOUNDARY_MASK) == 0)
+        if at_boundary or size >= MAX_CHUNK_CHARS:
+            chunks.append(''.join(current))
+            current = []
+            size = 0
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+def encode_chunk(text, codec=DEFAULT_CODEC):
+    """Compresses a chunk. Returns the compressed bytes."""
+    raw = text.encode('utf-8')
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    if codec == 'zlib':
+        return zlib.compress(raw, ZLIB_LEVEL)
+    raise ValueError(f"Unknown snapshot codec: {codec}")
+
+def decode_chunk(data, codec):
+    """Decompresses a chunk stored with the given codec."""
+    data = bytes(data) # psycopg2 returns BYTEA as memoryview
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Snapshot chunk is zstd-compressed but the 'zstandard' package is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown snapshot codec: {codec}")
@@ -0,0 +1,176 @@
+# MonitorScheduler/MonitorScheduler.py
+"""Standalone scheduler that checks monitoring targets on a fixed cadence, without the LLM.
+
+Targets (URL, selector, interval) are read from the monitor_targets table and
+kept on a priority queue ordered by next-due time. Due targets are run through
+WebsiteMonitor.pipeline.run_check on a worker pool. Each next-due time gets a
+random jitter so thousands of targets spread out instead of firing together,
+and a per-host rate limit keeps us from hammering any single site.
+"""
+import sys
+import time
+import heapq
+import random
+import threading
+import traceback
+import datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from Database.database_manager import get_active_monitor_targets, record_monitor_check
+from WebsiteMonitor.pipeline import run_check
+
+# --- Configuration Defaults ---
+DEFAULT_MAX_WORKERS = 16 # Concurrent checks
+DEFAULT_PER_HOST_INTERVAL = 1.0 # Min seconds between two checks against the same host
+DEFAULT_JITTER_FRACTION = 0.1 # Next-due time varies by +/- 10% of the interval
+DEFAULT_REFRESH_INTERVAL = 60 # Seconds between re-reading targets from the database
+MIN_INTERVAL_SECONDS = 30 # Guard against misconfigured targets
+
+class MonitorScheduler:
+    """Priority-queue scheduler for monitoring targets."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, per_host_interval=DEFAULT_PER_HOST_INTERVAL,
+                 jitter_fraction=DEFAULT_JITTER_FRACTION, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self.max_workers = max_workers
+        self.per_host_interval = per_host_interval
+        self.jitter_fraction = jitter_fraction
+        self.refresh_interval = refresh_interval
+
+        self._targets = {} # target_id -> target dict
+        self._queue = [] # heap of (due_time, seq, target_id, host_slot_reserved)
+        self._seq = 0 # Tie-breaker so heap entries never compare dicts
+        self._scheduled = set() # target_ids currently in the queue
+        self._in_flight = set() # target_ids currently being checked
+        self._host_next_slot = {} # host -> earliest time the next check may start
+        self._lock = threading.Condition()
+        self._stop_event = threading.Event()
+        self._next_refresh = 0.0
+
+    # --- Queue helpers (call with self._lock held) ---
+    def _push(self, due_time, target_id, host_slot_reserved=False):
+        self._seq += 1
+        heapq.heappush(self._queue, (due_time, self._seq, target_id, host_slot_reserved))
+        self._scheduled.add(target_id)
+        self._lock.notify()
+
+    def _interval(self, target):
+        return max(MIN_INTERVAL_SECONDS, target.get('interval_seconds') or MIN_INTERVAL_SECONDS)
+
+    def _jittered(self, interval):
+        return interval * (1 + random.uniform(-self.jitter_fraction, self.jitter_fraction))
+
+    def _initial_due_time(self, target, now):
+        """First due time for a newly loaded target, based on when it was last checked."""
+        interval = self._interval(target)
+        last_checked = target.get('last_checked_at')
+        if last_checked:
+            if last_checked.tzinfo is None:
+                last_checked = last_checked.replace(tzinfo=datetime.timezone.utc)
+            age = (datetime.datetime.now(datetime.timezone.utc) - last_checked).total_seconds()
+            if age < interval:
+                return now + self._jittered(interval - age)
+        # Never checked or overdue: spread the backlog over one jitter window instead of firing all at once
+        return now + random.uniform(0, interval * self.jitter_fraction)
+
+    def _reserve_host_slot(self, host, now):
+        """Reserves the next free slot for a host and returns its start time."""
+        slot = max(now, self._host_next_slot.get(host, 0.0))
+        self._host_next_slot[host] = slot + self.per_host_interval
+        return slot
+
+    # --- Target loading ---
+    def refresh_targets(self):
+        """Re-reads active targets from the database and schedules any new ones."""
+        targets = get_active_monitor_targets()
+        now = time.monotonic()
+        with self._lock:
+            new_targets = {t['id']: t for t in targets}
+            added = 0
+            for target_id, target in new_targets.items():
+                if target_id not in self._scheduled and target_id not in self._in_flight:
+                    self._push(self._initial_due_time(target, now), target_id)
+                    added += 1
+            removed = len(set(self._targets) - set(new_targets))
+            # Removed/deactivated targets are dropped lazily when they come off the queue
+            self._targets = new_targets
+        if added or removed:
+            print(f"Scheduler: {len(new_targets)} active targets ({added} scheduled, {removed} removed).")
+
+    # --- Execution ---
+    def _run_target(self, target):
+        target_id = target['id']
+        try:
+            result = run_check(target['url'], target['selector'], target_id=target_id, parser=target.get('parser'))
+            print(f"Scheduler: target {target_id} ({target['url']}) -> {result['status']} in {result['elapsed']:.2f}s")
+            if result['status'] == 'error':
+                print(f"Scheduler: target {target_id} error: {result['message']}", file=sys.stderr)
+            record_monitor_check(target_id, result['status'])
+        except Exception as e:
+            print(f"Scheduler: unexpected error checking target {target_id}: {e}", file=sys.stderr)
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._in_flight.discard(target_id)
+                # Reschedule unless the target was removed meanwhile
+                current = self._targets.get(target_id)
+                if current:
+                    self._push(time.monotonic() + self._jittered(self._interval(current)), target_id)
+
+    def _pop_due(self, now):
+        """Pops the next due target that may run now. Returns (target, wait_seconds)."""
+        while self._queue:
+            due_time, _, target_id, host_slot_reserved = self._queue[0]
+            if due_time > now:
+                return None, due_time - now
+            heapq.heappop(self._queue)
+            self._scheduled.discard(target_id)
+            target = self._targets.get(target_id)
+            if not target:
+                continue # Deactivated or deleted since it was queued
+            if not host_slot_reserved:
+                host = urlsplit(target['url']).netloc.lower()
+                slot = self._reserve_host_slot(host, now)
+                if slot > now:
+                    # Host is rate limited: come back at the reserved slot
+                    self._push(slot, target_id, host_slot_reserved=True)
+                    continue
+            return target, 0.0
+        return None, None
+
+    def run_forever(self):
+        """Runs the scheduling loop until stop() is called."""
+        print(f"Scheduler: starting (workers={self.max_workers}, per-host interval={self.per_host_interval}s, "
+              f"jitter={self.jitter_fraction:.0%}).")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                if now >= self._next_refresh:
+                    try:
+                        self.refresh_targets()
+                    except Exception as e:
+                        print(f"Scheduler: error refreshing targets: {e}", file=sys.stderr)
+                    self._next_refresh = now + self.refresh_interval
+
+                with self._lock:
+                    target, wait = self._pop_due(time.monotonic())
+                    if target:
+                        # Bound the backlog to the pool size so due times stay meaningful
+                        if len(self._in_flight) >= self.max_workers:
+                            self._push(time.monotonic(), target['id'], host_slot_reserved=True)
+                            self._lock.wait(timeout=1.0)
+                            continue
+                        self._in_flight.add(target['id'])
+                    else:
+                        until_refresh = max(0.0, self._next_refresh - time.monotonic())
+                        timeout = until_refresh if wait is None else min(wait, until_refresh)
+                        self._lock.wait(timeout=timeout)
+                        continue
+                executor.submit(self._run_target, target)
+        print("Scheduler: stopped.")
+
+    def stop(self):
+        """Asks the scheduling loop to exit after in-flight checks complete."""
+        self._stop_event.set()
+        with self._lock:
+            self._lock.notify_all()
@@ -0,0 +1 @@
+from .MonitorScheduler import MonitorScheduler
@@ -31,7 +31,7 @@ def view_settings():
         # Optionally flash a message
 
     # Get token limit from config
-    token_limit = current_app.config.get('FREE_TIER_TOKEN_LIMIT', 200)
+    token_limit = current_app.config.get('FREE_TIER_TOKEN_LIMIT', 20000)
 
     # Instantiate forms for rendering
     change_password_form = ChangePasswordForm()
@@ -0,0 +1,79 @@
+# WebsiteMonitor/pipeline.py
+"""Runs the fetch -> extract -> compare -> notify pipeline directly, without the LLM.
+
+Uses the same functions as the four WebsiteMonitor tools, so a scheduled check
+behaves exactly like a check requested through the agency.
+"""
+import time
+
+from .tools.fetch_content_tool import fetch_shared
+from .tools.extract_content_tool import extract_regions
+from .tools.compare_and_persist_tool import compare_regions
+from .tools.notification_tool import send_notification
+from .tools.validator_store import get_validator_store
+
+def run_multi_check(url, selectors, force_refresh=False, target_ids=None, parser=None):
+    """Checks several regions of one URL ({name: CSS selector}) with one fetch and one parse.
+
+    Each region is compared against its own URL + selector target; `target_ids`
+    optionally maps region name -> known target ID. `parser` selects the HTML
+    parser backend (default: the configured one).
+
+    Returns a dict with keys: url, regions ({name: {selector, status, message,
+    notification}}, status being 'changed', 'unchanged', 'not_modified' or
+    'error'), elapsed (seconds).
+    """
+    start = time.perf_counter()
+    result = {"url": url, "elapsed": 0.0,
+              "regions": {name: {"selector": selector, "status": "error", "message": None, "notification": None}
+                          for name, selector in selectors.items()}}
+    try:
+        validators = None if force_refresh else get_validator_store().get(url, list(selectors.values()))
+        fetched = fetch_shared(url, validators=validators) # Shared with other watchers of this URL
+        if not fetched["ok"]:
+            for region in result["regions"].values():
+                region["message"] = fetched["error"]
+            return result
+
+        contents, errors = {}, {}
+        if not fetched["not_modified"]:
+            contents, errors = extract_regions(fetched["html"], selectors, parser=parser)
+
+        compared = compare_regions(url, selectors, contents, validators=fetched["validators"],
+                                   not_modified=fetched["not_modified"], target_ids=target_ids)
+        if not compared["ok"] and fetched["not_modified"] and not force_refresh:
+            # 304 but a region has no stored baseline: fetch the full page once
+            return run_multi_check(url, selectors, force_refresh=True, target_ids=target_ids, parser=parser)
+
+        for name, region in result["regions"].items():
+            region_result = compared["regions"][name]
+            if name in errors:
+                region["message"] = errors[name]
+            elif not region_result["ok"]:
+                region["message"] = region_result["message"]
+            elif region_result["change_detected"]:
+                region["status"] = "changed"
+                region["message"] = region_result["message"]
+                region["notification"] = send_notification(url, region_result["new_content_snippet"],
+                                                           region_result["diff_text"])
+            else:
+                region["status"] = "not_modified" if fetched["not_modified"] else "unchanged"
+                region["message"] = region_result["message"]
+        return result
+    finally:
+        result["elapsed"] = time.perf_counter() - start
+
+def run_check(url, selector, force_refresh=False, target_id=None, parser=None):
+    """Checks one URL/selector pair for changes.
+
+    `target_id` may be given when the monitor target is already known (e.g. by the scheduler).
+    `parser` selects the HTML parser backend (default: the configured one).
+
+    Returns a dict with keys: url, selector, status ('changed', 'unchanged',
+    'not_modified' or 'error'), message, notification, elapsed (seconds).
+    """
+    checked = run_multi_check(url, {selector: selector}, force_refresh=force_refresh,
+                              target_ids={selector: target_id} if target_id is not None else None, parser=parser)
+    region = checked["regions"][selector]
+    return {"url": url, "selector": selector, "status": region["status"], "message": region["message"],
+            "notification": region["notification"], "elapsed": checked["elapsed"]}
@@ -0,0 +1,33 @@
+from typing import Dict, List, Optional
+from agency_swarm.tools import BaseTool
+from .fetch_content_tool import fetch_many, MAX_PER_HOST
+from .validator_store import get_validator_store
+
+# Import Field from Pydantic (v2 first: BaseTool is a v2 model, so v1 defaults would not apply)
+try:
+    from pydantic import Field
+except ImportError:
+    from pydantic.v1 import Field
+
+class BatchFetchContentTool(BaseTool):
+    """Fetches many URLs concurrently and reports per-URL status and timing."""
+    urls: List[str] = Field(..., description="The list of website URLs to fetch in one sweep.")
+    selectors: Optional[Dict[str, str]] = Field(None, description="Optional {URL: CSS selector} of the content watched on each page. URLs listed here are fetched conditionally (HTTP 304 if unchanged since that selector's last check).")
+    per_host_limit: int = Field(MAX_PER_HOST, description="Maximum number of concurrent requests against a single host.")
+
+    def run(self):
+        print(f"Tool: Batch fetching {len(self.urls)} URLs")
+        results = fetch_many(self.urls, per_host_limit=self.per_host_limit, validator_store=get_validator_store(),
+                             selectors=self.selectors)
+        # Keep the bodies in shared state for follow-up extraction, keyed by URL
+        self._shared_state.set("batch_results", {r["url"]: r for r in results})
+
+        lines = []
+        for r in results:
+            if r["not_modified"]:
+                lines.append(f"{r['url']}: NOT MODIFIED 304 ({r['elapsed']:.2f}s)")
+            elif r["ok"]:
+                lines.append(f"{r['url']}: OK {r['status_code']} ({r['elapsed']:.2f}s, {len(r['html'])} chars)")
+            else:
+                lines.append(f"{r['url']}: FAILED ({r['elapsed']:.2f}s) - {r['error']}")
+        return "\n".join(lines)
@@ -1,6 +1,12 @@
 import os
 import hashlib
 from agency_swarm.tools import BaseTool
+from Database.database_manager import (get_or_create_monitor_target, get_latest_snapshot, add_snapshot,
+                                       get_target_fingerprint, set_target_fingerprint, prune_snapshots)
+from Database.snapshot_codec import content_digest
+from .validator_store import get_validator_store
+from .content_diff import diff_texts, format_diff, summarize_diff
+from .step_events import emit_step
 
 # Import Field from Pydantic
 try:
@@ -13,20 +19,176 @@ DATA_DIR = 'data'
 MAX_CONTENT_SNIPPET = 200 # Max chars for notification snippet
 
 # --- Helper Function ---
-def get_file_path(url):
-    """Generates a consistent file path for storing URL content."""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
+def get_legacy_file_path(url):
+    """Path of the pre-database content file for a URL (data/<md5 of url>.txt)."""
     url_hash = hashlib.md5(url.encode()).hexdigest()
     return os.path.join(DATA_DIR, f"{url_hash}.txt")
 
+def _read_legacy_content(url):
+    """Reads content stored by the old file-based store, so switching stores doesn't report a change."""
+    try:
+        with open(get_legacy_file_path(url), 'r', encoding='utf-8') as f:
+            return f.read()
+    except (FileNotFoundError, OSError):
+        return None
+
+# --- Plain Python API (usable without the agency) ---
+def compare_and_persist(url, selector, new_content, validators=None, not_modified=False, target_id=None,
+                        commit_validators=True):
+    """Compares new content for a URL + selector with its latest snapshot and stores it if it changed.
+
+    `validators` are the fetch's ETag/Last-Modified; they are committed to the
+    validator store only once the content they describe is stored (callers that
+    store several regions of the page pass commit_validators=False and commit
+    once all of them are stored). If
+    `not_modified` is set (HTTP 304), the comparison is skipped. `target_id` may
+    be passed by callers that already know the monitor target.
+
+    The target's stored fingerprint (BLAKE2b digest + length) is checked first;
+    the previous snapshot is only loaded when it differs or is missing.
+
+    Returns a dict with keys: ok, target_id, change_detected, previous_content_snippet,
+    new_content_snippet, diff (structured, None on the first check), diff_text, message.
+    """
+    result = {"ok": False, "target_id": target_id, "change_detected": False, "previous_content_snippet": None,
+              "new_content_snippet": None, "diff": None, "diff_text": None, "message": None}
+
+    if target_id is None:
+        target_id = get_or_create_monitor_target(url, selector)
+        if target_id is None:
+            result["message"] = f"Error: Could not look up the monitor target for {url}."
+            return result
+        result["target_id"] = target_id
+
+    # Fast path: compare against the stored fingerprint before loading any previous content
+    fingerprint = get_target_fingerprint(target_id)
+
+    if not_modified:
+        if fingerprint is None:
+            try:
+                has_baseline = get_latest_snapshot(target_id) is not None
+            except Exception as e:
+                result["message"] = f"Error reading previous content for {url}: {e}"
+                return result
+            if not has_baseline:
+                # Validators without a stored baseline for this selector: they are useless here
+                get_validator_store().forget(url, selector)
+                result["message"] = f"No stored content for {url} to compare against. Run FetchContentTool again with force_refresh set to true."
+                return result
+        print(f"No change detected for {url} (HTTP 304).")
+        result["ok"] = True
+        result["message"] = f"No change detected for {url} (not modified since last check)."
+        return result
+
+    if new_content is None:
+         new_content = ""
+    new_hash = content_digest(new_content)
+
+    if fingerprint is not None and fingerprint == (new_hash, len(new_content)):
+        print(f"No change detected for {url}.")
+        result["message"] = f"No change detected for {url}."
+        if commit_validators:
+            get_validator_store().set(url, selector, validators)
+        result["ok"] = True
+        return result
+
+    # Digest differs or was never recorded: load the previous content to build the change report
+    try:
+        latest = get_latest_snapshot(target_id) # Single indexed lookup on (target_id, fetched_at)
+    except Exception as e:
+        result["message"] = f"Error reading previous content for {url}: {e}"
+        return result
+
+    change_detected = False
+    first_check = False
+    if latest is not None:
+        previous_content = latest["content"]
+    else:
+        previous_content = _read_legacy_content(url)
+    if previous_content is None:
+        print(f"No previous data found for {url}. First check.")
+        previous_content = ""
+        change_detected = True
+        first_check = True
+    elif previous_content != new_content:
+        print(f"Change detected for {url}.")
+        change_detected = True
+
+    if change_detected:
+        diff = None
+        summary = f"Content changed ({len(previous_content)} -> {len(new_content)} chars)."
+        if not first_check:
+            diff = diff_texts(previous_content, new_content)
+            summary = summarize_diff(diff)
+        if add_snapshot(target_id, new_content, change_summary=summary, content_hash=new_hash, change_diff=diff) is None:
+            result["message"] = f"Error storing new content for {url}."
+            return result
+        print(f"Updated stored content for {url}.")
+        prune_snapshots(target_id) # Apply the retention policy now that a new version exists
+        result["change_detected"] = True
+        result["previous_content_snippet"] = previous_content[:MAX_CONTENT_SNIPPET]
+        result["new_content_snippet"] = new_content[:MAX_CONTENT_SNIPPET]
+        if diff is not None:
+            result["diff"] = diff
+            result["diff_text"] = format_diff(diff)
+            result["message"] = f"Change detected for {url}. Content updated.\n{result['diff_text']}"
+        else:
+            result["message"] = f"First check of {url}. Content stored."
+    else:
+        if latest is None:
+            # Matches the legacy file: import it as the first snapshot, without a change event
+            add_snapshot(target_id, new_content, content_hash=new_hash)
+        else:
+            # Snapshot stored before fingerprints existed: backfill so the next check takes the fast path
+            set_target_fingerprint(target_id, new_hash, len(new_content))
+        print(f"No change detected for {url}.")
+        result["message"] = f"No change detected for {url}."
+
+    if commit_validators:
+        get_validator_store().set(url, selector, validators)
+    result["ok"] = True
+    return result
+
+def compare_regions(url, selectors, contents, validators=None, not_modified=False, target_ids=None):
+    """Compares several regions of one page, each against the snapshots of its own URL + selector target.
+
+    `selectors` maps region name -> CSS selector and `contents` maps region name ->
+    extracted text; regions missing from `contents` (extraction failed) count as
+    failed. `target_ids` optionally maps region name -> known monitor target ID.
+    Validators are committed only when every region was stored, so a 304 never
+    hides a region whose new content was not saved.
+
+    Returns a dict with keys: ok (all regions ok), change_detected (any region),
+    regions ({name: compare_and_persist result}), diff_text, message.
+    """
+    target_ids = target_ids or {}
+    results = {}
+    for name, selector in selectors.items():
+        if not not_modified and name not in contents:
+            results[name] = {"ok": False, "target_id": target_ids.get(name), "change_detected": False,
+                             "previous_content_snippet": None, "new_content_snippet": None, "diff": None,
+                             "diff_text": None, "message": f"No content extracted for region '{name}'."}
+            continue
+        results[name] = compare_and_persist(url, selector, contents.get(name), validators=validators,
+                                            not_modified=not_modified, target_id=target_ids.get(name),
+                                            commit_validators=False)
+
+    ok = all(r["ok"] for r in results.values())
+    if ok:
+        get_validator_store().set(url, list(selectors.values()), validators)
+    changed = {name: r for name, r in results.items() if r["change_detected"]}
+    diff_parts = [f"[{name}]\n{r['diff_text'] or r['new_content_snippet']}" for name, r in changed.items()]
+    return {"ok": ok, "change_detected": bool(changed), "regions": results,
+            "diff_text": "\n".join(diff_parts) if diff_parts else None,
+            "message": "\n".join(f"[{name}] {r['message']}" for name, r in results.items())}
+
 class CompareAndPersistTool(BaseTool):
     """Compares extracted content with the stored version, updates storage, and reports changes."""
     # No input fields needed, uses shared state
 
     def run(self):
-        print("Tool: Comparing and Persisting content...")
         url = self._shared_state.get("current_url")
+        selector = self._shared_state.get("current_selector")
         new_content = self._shared_state.get("extracted_content")
         fetch_extract_error = self._shared_state.get("error")
 
@@ -34,38 +196,43 @@ class CompareAndPersistTool(BaseTool):
             return f"Skipping compare/persist due to error: {fetch_extract_error}"
         if url is None:
             return "Error: URL not found in shared state for comparison."
-        if new_content is None:
-             new_content = ""
+        emit_step("CompareAndPersistTool", "Comparing and persisting content...", url=url)
 
-        file_path = get_file_path(url)
-        previous_content = ""
-        change_detected = False
-
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                previous_content = f.read()
-        except FileNotFoundError:
-            print(f"No previous data found for {url}. First check.")
-            change_detected = True
-        except Exception as e:
-            return f"Error reading previous content file {file_path}: {e}"
-
-        if not change_detected and previous_content != new_content:
-            print(f"Change detected for {url}.")
-            change_detected = True
-
-        if change_detected:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(new_content)
-                print(f"Updated stored content for {url}.")
-                self._shared_state.set("change_detected", True)
-                self._shared_state.set("previous_content_snippet", previous_content[:MAX_CONTENT_SNIPPET])
-                self._shared_state.set("new_content_snippet", new_content[:MAX_CONTENT_SNIPPET])
-                return f"Change detected for {url}. Content updated."
-            except Exception as e:
-                return f"Error writing new content file {file_path}: {e}"
-        else:
-            print(f"No change detected for {url}.")
-            self._shared_state.set("change_detected", False)
-            return f"No change detected for {url}." 
\ No newline at end of file
+        regions = self._shared_state.get("current_regions")
+        if self._shared_state.get("not_modified"):
+            # A 304 only vouches for the selectors whose validators were sent with the request
+            checked = sorted(regions.values()) if regions else [selector]
+            if sorted(self._shared_state.get("conditional_selectors") or []) != checked:
+                self._shared_state.set("pending_validators", None)
+                return ("The page was fetched conditionally for a different selector. Run FetchContentTool again "
+                        "with the selector(s) you extract, or with force_refresh set to true.")
+        if regions:
+            result = compare_regions(url, regions, self._shared_state.get("extracted_regions") or {},
+                                     validators=self._shared_state.get("pending_validators"),
+                                     not_modified=self._shared_state.get("not_modified"))
+            self._shared_state.set("pending_validators", None)
+            self._shared_state.set("change_detected", result["change_detected"])
+            emit_step("CompareAndPersistTool", "Change detected" if result["change_detected"] else "Compared regions",
+                      url=url, status="error" if not result["ok"] else "changed" if result["change_detected"] else "unchanged",
+                      regions={name: r["change_detected"] for name, r in result["regions"].items()})
+            if result["change_detected"]:
+                self._shared_state.set("new_content_snippet", None)
+                self._shared_state.set("diff_text", result["diff_text"])
+            return result["message"]
+
+        if selector is None:
+            return "Error: Selector not found in shared state. Run ExtractContentTool before comparing."
+
+        result = compare_and_persist(url, selector, new_content,
+                                     validators=self._shared_state.get("pending_validators"),
+                                     not_modified=self._shared_state.get("not_modified"))
+        self._shared_state.set("pending_validators", None)
+        emit_step("CompareAndPersistTool", result["message"].split("\n")[0], url=url, selector=selector,
+                  status="error" if not result["ok"] else "changed" if result["change_detected"] else "unchanged")
+        if result["ok"]:
+            self._shared_state.set("change_detected", result["change_detected"])
+            if result["change_detected"]:
+                self._shared_state.set("previous_content_snippet", result["previous_content_snippet"])
+                self._shared_state.set("new_content_snippet", result["new_content_snippet"])
+                self._shared_state.set("diff_text", result["diff_text"])
+        return result["message"]
@@ -0,0 +1,206 @@
+"""Word-level diff of extracted content.
+
+Extracted content is usually one long line (regions are joined with spaces),
+so the diff works on word tokens, not lines. Common leading/trailing tokens are
+trimmed first (a linear pass), so a small edit in a large page only diffs the
+few words around it. The remaining middle is diffed with Myers' O(ND) algorithm
+on interned tokens. The edit distance D is capped, so the cost stays linear in
+the content size; above the cap the middle is reported as one replaced block.
+
+Only the changed spans and a few words of context around them are kept, and
+long spans are shortened, so a stored diff stays small however large the page.
+"""
+import re
+from itertools import accumulate
+
+# --- Configuration & Constants ---
+MAX_WORD_EDITS = 2000 # Myers edit-distance cap, in tokens
+CONTEXT_WORDS = 8 # Unchanged words kept before and after each change
+MAX_SPAN_CHARS = 400 # Longer removed/inserted spans are stored shortened (start and end kept)
+MAX_HUNKS = 50 # Changes beyond this many hunks are counted but not stored
+MAX_DIFF_TEXT_CHARS = 2000 # Size limit of the rendered diff sent to notifications and the chat
+
+_WORD_RE = re.compile(r'\s+|[^\s]+')
+
+def _myers(a, b, max_edits):
+    """Edit script between sequences a and b as a list of (op, a_start, a_end, b_start, b_end).
+
+    op is 'equal', 'delete', 'insert'. Returns None if more than max_edits edits are needed.
+    """
+    n, m = len(a), len(b)
+    offset = max_edits + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    for d in range(max_edits + 1):
+        trace.append(v[offset - d:offset + d + 1] if d else [v[offset]])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1] # Step down: insertion from b
+            else:
+                x = v[offset + k - 1] + 1 # Step right: deletion from a
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, d, n, m)
+    return None
+
+def _backtrack(trace, d_end, n, m):
+    """Rebuilds the edit script from the saved V arrays (trace[d] covers diagonals -d..d)."""
+    ops = []
+    x, y = n, m
+    for d in range(d_end, 0, -1):
+        prev = trace[d] # V as it was before step d; index i holds diagonal i - d
+        k = x - y
+        if k == -d or (k != d and prev[k - 1 + d] < prev[k + 1 + d]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        px = prev[prev_k + d]
+        py = px - prev_k
+        start_x = px if prev_k == k + 1 else px + 1
+        start_y = start_x - k
+        if x > start_x:
+            ops.append(('equal', start_x, x, start_y, y))
+        if prev_k == k + 1:
+            ops.append(('insert', px, px, py, start_y))
+        else:
+            ops.append(('delete', px, start_x, py, py))
+        x, y = px, py
+    if x > 0:
+        ops.append(('equal', 0, x, 0, y))
+    ops.reverse()
+    return ops
+
+def _opcodes(a, b, max_edits):
+    """Merged opcodes ('equal', 'delete', 'insert', 'replace') like difflib, with prefix/suffix trimming."""
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[len(a) - 1 - suffix] == b[len(b) - 1 - suffix]:
+        suffix += 1
+    mid_a = a[prefix:len(a) - suffix]
+    mid_b = b[prefix:len(b) - suffix]
+
+    script = _myers(mid_a, mid_b, max_edits) if mid_a and mid_b else None
+    if script is None:
+        # One side empty, or too different: a single block
+        script = []
+        if mid_a:
+            script.append(('delete', 0, len(mid_a), 0, 0))
+        if mid_b:
+            script.append(('insert', len(mid_a), len(mid_a), 0, len(mid_b)))
+
+    opcodes = []
+    if prefix:
+        opcodes.append(['equal', 0, prefix, 0, prefix])
+    for op, a1, a2, b1, b2 in script:
+        a1, a2, b1, b2 = a1 + prefix, a2 + prefix, b1 + prefix, b2 + prefix
+        if op == 'equal' and a1 == a2:
+            continue
+        last = opcodes[-1] if opcodes else None
+        if last and last[0] != 'equal' and op != 'equal':
+            # Merge adjacent deletes/inserts; a block with both sides becomes a replace below
+            last[2] = max(last[2], a2)
+            last[4] = max(last[4], b2)
+        else:
+            opcodes.append([op, a1, a2, b1, b2])
+    if suffix:
+        opcodes.append(['equal', len(a) - suffix, len(a), len(b) - suffix, len(b)])
+    for code in opcodes:
+        if code[0] in ('delete', 'insert') and code[2] > code[1] and code[4] > code[3]:
+            code[0] = 'replace'
+    return [tuple(code) for code in opcodes]
+
+def _intern(lines, table):
+    return [table.setdefault(line, len(table)) for line in lines]
+
+def _shorten(text, max_chars=MAX_SPAN_CHARS):
+    if len(text) <= max_chars:
+        return text
+    half = max_chars // 2
+    return f"{text[:half]} [... {len(text) - 2 * half} chars ...] {text[-half:]}"
+
+def _count_words(tokens):
+    return sum(1 for token in tokens if not token.isspace())
+
+def diff_texts(old_text, new_text):
+    """Structured word-level diff between two versions of extracted content.
+
+    Returns a dict with keys: words_added, words_removed, hunks, hunks_omitted.
+    Each hunk has new_offset (character position of the change in new_text),
+    before and after (unchanged context) and spans: {"op": equal/delete/insert,
+    "text"} with long deleted/inserted texts shortened. Changes closer together
+    than twice the context form one hunk.
+    """
+    old_tokens = _WORD_RE.findall(old_text)
+    new_tokens = _WORD_RE.findall(new_text)
+    table = {}
+    opcodes = _opcodes(_intern(old_tokens, table), _intern(new_tokens, table), MAX_WORD_EDITS)
+    new_offsets = [0] + list(accumulate(len(token) for token in new_tokens))
+    context = 2 * CONTEXT_WORDS # Tokens: words and the whitespace between them
+
+    # Group changes separated by short unchanged runs into hunks: lists of opcodes
+    groups = []
+    for index, code in enumerate(opcodes):
+        op, a1, a2, b1, b2 = code
+        if op != 'equal':
+            if groups and groups[-1][-1] == index - 1:
+                groups[-1].append(index)
+            else:
+                groups.append([index])
+        elif groups and groups[-1][-1] == index - 1 and a2 - a1 <= 2 * context and index + 1 < len(opcodes):
+            groups[-1].append(index) # Short gap, joined to the next change
+
+    words_added = words_removed = 0
+    hunks = []
+    for group in groups:
+        first, last = opcodes[group[0]], opcodes[group[-1]]
+        spans = []
+        for op, a1, a2, b1, b2 in (opcodes[i] for i in group):
+            if op == 'equal':
+                spans.append({"op": "equal", "text": ''.join(old_tokens[a1:a2])})
+                continue
+            words_removed += _count_words(old_tokens[a1:a2])
+            words_added += _count_words(new_tokens[b1:b2])
+            if len(hunks) >= MAX_HUNKS:
+                continue
+            if a2 > a1:
+                spans.append({"op": "delete", "text": _shorten(''.join(old_tokens[a1:a2]))})
+            if b2 > b1:
+                spans.append({"op": "insert", "text": _shorten(''.join(new_tokens[b1:b2]))})
+        if len(hunks) >= MAX_HUNKS:
+            continue
+        hunks.append({
+            "new_offset": new_offsets[first[3]],
+            "before": ''.join(old_tokens[max(0, first[1] - context):first[1]]),
+            "after": ''.join(old_tokens[last[2]:last[2] + context]),
+            "spans": spans,
+        })
+    return {"words_added": words_added, "words_removed": words_removed, "hunks": hunks,
+            "hunks_omitted": max(0, len(groups) - MAX_HUNKS)}
+
+def summarize_diff(diff):
+    """One-line summary of a structured diff, e.g. for the change event."""
+    return f"{diff['words_added']} word(s) added, {diff['words_removed']} word(s) removed."
+
+def format_diff(diff, max_chars=MAX_DIFF_TEXT_CHARS):
+    """Renders a structured diff as compact text: ...context [-removed-]{+added+} context..."""
+    out = [summarize_diff(diff)]
+    for hunk in diff["hunks"]:
+        rendered = ''.join(span["text"] if span["op"] == "equal"
+                           else f"[-{span['text']}-]" if span["op"] == "delete"
+                           else f"{{+{span['text']}+}}"
+                           for span in hunk["spans"])
+        out.append(f"@@ char {hunk['new_offset']} @@")
+        out.append(f"...{hunk['before']}{rendered}{hunk['after']}...")
+    if diff["hunks_omitted"]:
+        out.append(f"... and {diff['hunks_omitted']} more change(s)")
+    text = '\n'.join(out)
+    if len(text) > max_chars:
+        text = text[:max_chars].rstrip() + "\n... (diff truncated)"
+    return text
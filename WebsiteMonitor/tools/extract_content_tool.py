@@ -1,18 +1,160 @@
-from bs4 import BeautifulSoup
+import os
+import re
+import importlib.util
+from typing import Dict, Optional
+from bs4 import BeautifulSoup, SoupStrainer
 from agency_swarm.tools import BaseTool
+from .step_events import emit_step
 
-# Import Field from Pydantic
 try:
-    from pydantic.v1 import Field
+    from selectolax.lexbor import LexborHTMLParser # Optional: fastest backend
 except ImportError:
+    LexborHTMLParser = None
+
+# Import Field from Pydantic (v2 first: BaseTool is a v2 model, so v1 defaults would not apply)
+try:
     from pydantic import Field
+except ImportError:
+    from pydantic.v1 import Field
+
+# --- Configuration & Globals ---
+# 'lxml' and 'html5lib' are BeautifulSoup tree builders; 'selectolax' uses the lexbor engine directly
+PARSER_BACKENDS = ('html.parser', 'lxml', 'html5lib', 'selectolax')
+_BACKEND_MODULES = {'lxml': 'lxml', 'html5lib': 'html5lib'}
+
+# First compound of a selector made of tag/#id/.class only, e.g. "div#main.content"
+_SIMPLE_COMPOUND_RE = re.compile(r'^(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<rest>(?:[#.][\w-]+)*)$')
+
+def is_backend_available(backend):
+    """True if the parser backend's library is installed."""
+    if backend == 'html.parser':
+        return True
+    if backend == 'selectolax':
+        return LexborHTMLParser is not None
+    return importlib.util.find_spec(_BACKEND_MODULES[backend]) is not None
+
+# Env HTML_PARSER picks the default backend. html.parser stays the default: the backends repair broken
+# markup differently, so switching existing targets would report a spurious change for many of them.
+# lxml (much faster) is opt-in, via HTML_PARSER or per target.
+DEFAULT_PARSER = os.getenv("HTML_PARSER") or 'html.parser'
+
+def selector_strainer(selector):
+    """SoupStrainer that keeps only the subtrees a selector can match, or None if the selector needs the whole document.
+
+    Only the first compound of the selector is used (tag, first #id, first .class),
+    so the strainer keeps a superset of the matches' outermost ancestors; the full
+    selector is still applied to the partial tree. Selector lists and sibling
+    combinators need elements outside those subtrees and get no strainer.
+    """
+    selector = selector.strip()
+    if not selector or any(c in selector for c in ',+~'):
+        return None
+    first = re.split(r'\s*>\s*|\s+', selector, maxsplit=1)[0]
+    match = _SIMPLE_COMPOUND_RE.match(first)
+    if not match:
+        return None
+    tag = match.group('tag')
+    tag = tag.lower() if tag and tag != '*' else None
+    ids = re.findall(r'#([\w-]+)', match.group('rest'))
+    classes = re.findall(r'\.([\w-]+)', match.group('rest'))
+    if not (tag or ids or classes):
+        return None
+    attrs = {}
+    if ids:
+        attrs['id'] = ids[0]
+    if classes:
+        wanted = classes[0]
+        # Match one class of a multi-valued class attribute (a plain string would have to equal the whole attribute)
+        attrs['class'] = lambda value: value is not None and wanted in (value.split() if isinstance(value, str) else value)
+    return SoupStrainer(tag, attrs=attrs)
+
+# --- Plain Python API (usable without the agency) ---
+def _resolve_backend(parser):
+    """Returns (backend, error_msg) for a requested parser backend (None = default)."""
+    backend = parser or DEFAULT_PARSER
+    if backend not in PARSER_BACKENDS:
+        return None, f"Error: Unknown parser backend '{backend}'. Use one of: {', '.join(PARSER_BACKENDS)}."
+    if not is_backend_available(backend):
+        return None, f"Error: Parser backend '{backend}' is not installed."
+    return backend, None
+
+def _select_texts(document, backend, selector):
+    if backend == 'selectolax':
+        return [node.text(separator=' ', strip=True) for node in document.css(selector)]
+    return [elem.get_text(separator=' ', strip=True) for elem in document.select(selector)]
+
+def extract_regions(html_content, selectors, parser=None, partial=True):
+    """Extracts several named regions ({name: CSS selector}) from one parse of the document.
+
+    `parser` is one of PARSER_BACKENDS (default: DEFAULT_PARSER). Backends may
+    differ slightly in how they repair broken markup, so switching the backend
+    of a target can report one change. With `partial`, BeautifulSoup backends
+    only build the subtrees the selector can match (see selector_strainer); this
+    applies when all regions use the same selector.
+
+    Returns a tuple (regions, errors): {name: extracted_text} for the regions that
+    matched and {name: error_msg} for the others.
+    """
+    backend, error_msg = _resolve_backend(parser)
+    if error_msg:
+        return {}, {name: error_msg for name in selectors}
+    unique_selectors = set(selectors.values())
+    try:
+        if backend == 'selectolax':
+            document = LexborHTMLParser(html_content)
+        else:
+            # html5lib always builds the full tree, so it gets no strainer
+            strainer = None
+            if partial and backend != 'html5lib' and len(unique_selectors) == 1:
+                strainer = selector_strainer(next(iter(unique_selectors)))
+            document = BeautifulSoup(html_content, backend, parse_only=strainer)
+    except Exception as e:
+        return {}, {name: f"Error parsing HTML or extracting content with selector '{selector}': {e}"
+                    for name, selector in selectors.items()}
+
+    regions, errors = {}, {}
+    for name, selector in selectors.items():
+        try:
+            texts = _select_texts(document, backend, selector)
+        except Exception as e:
+            errors[name] = f"Error parsing HTML or extracting content with selector '{selector}': {e}"
+            continue
+        if not texts:
+            errors[name] = f"Error: No elements found matching selector '{selector}'."
+            continue
+        regions[name] = ' '.join(texts) # "" when the elements have no text (vs. an error)
+    return regions, errors
+
+def extract_content(html_content, selector, parser=None, partial=True):
+    """Extracts the text of all elements matching a CSS selector (see extract_regions for the options).
+
+    Returns a tuple (extracted_text, error_msg); exactly one of them is None.
+    """
+    regions, errors = extract_regions(html_content, {selector: selector}, parser=parser, partial=partial)
+    if errors:
+        return None, errors[selector]
+    return regions[selector], None
 
 class ExtractContentTool(BaseTool):
-    """Extracts text from HTML using a CSS selector with BeautifulSoup."""
-    selector: str = Field(..., description="The CSS selector to target the desired content.")
+    """Extracts text from HTML using a CSS selector, or several named selectors from one parse."""
+    selector: Optional[str] = Field(None, description="The CSS selector to target the desired content.")
+    selectors: Optional[Dict[str, str]] = Field(None, description="Several regions to extract at once, as {region name: CSS selector}. Use instead of 'selector' when watching more than one part of the page.")
+    parser: Optional[str] = Field(None, description="Optional parser backend: 'html.parser', 'lxml', 'html5lib' or 'selectolax'. Leave empty for the default.")
 
     def run(self):
-        print(f"Tool: Extracting content with selector: {self.selector}")
+        if not self.selector and not self.selectors:
+            return "Error: Provide either 'selector' or 'selectors'."
+        if self.selectors:
+            emit_step("ExtractContentTool", f"Extracting regions: {', '.join(self.selectors)}", selectors=dict(self.selectors))
+            # Stored content is keyed by URL + selector, so each region is compared separately
+            self._shared_state.set("current_selector", None)
+            self._shared_state.set("current_regions", dict(self.selectors))
+        else:
+            emit_step("ExtractContentTool", f"Extracting content with selector: {self.selector}", selector=self.selector)
+            self._shared_state.set("current_selector", self.selector) # Stored content is keyed by URL + selector
+            self._shared_state.set("current_regions", None)
+        if self._shared_state.get("not_modified"): # 304 from fetch, nothing to parse
+            return "Skipping extraction: content has not been modified since the last check."
         html_content = self._shared_state.get("fetched_html")
         if not html_content:
             error_msg = "Error: No fetched HTML content found in shared state."
@@ -21,21 +163,24 @@ class ExtractContentTool(BaseTool):
         if self._shared_state.get("error"): # Check if fetch failed
              return f"Skipping extraction due to fetch error: {self._shared_state.get('error')}"
 
-        try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            elements = soup.select(self.selector)
-            if not elements:
-                error_msg = f"Error: No elements found matching selector '{self.selector}'."
+        if self.selectors:
+            regions, errors = extract_regions(html_content, self.selectors, parser=self.parser)
+            self._shared_state.set("extracted_regions", regions)
+            self._shared_state.set("region_errors", errors)
+            emit_step("ExtractContentTool", f"Extracted {len(regions)} of {len(self.selectors)} regions",
+                      status="ok" if regions else "error", regions=list(regions), errors=errors)
+            if not regions:
+                error_msg = "; ".join(f"{name}: {msg}" for name, msg in errors.items())
                 self._shared_state.set("error", error_msg)
                 return error_msg
+            lines = [f"{name}: extracted" for name in regions] + [f"{name}: {msg}" for name, msg in errors.items()]
+            return "Extracted regions:\n" + "\n".join(lines)
 
-            extracted_text = ' '.join(elem.get_text(separator=' ', strip=True) for elem in elements)
-            if not extracted_text:
-                 extracted_text = "" # Represent no text found vs. an error
-
-            self._shared_state.set("extracted_content", extracted_text)
-            return f"Successfully extracted content using selector: {self.selector}"
-        except Exception as e:
-            error_msg = f"Error parsing HTML or extracting content with selector '{self.selector}': {e}"
+        extracted_text, error_msg = extract_content(html_content, self.selector, parser=self.parser)
+        emit_step("ExtractContentTool", error_msg or f"Extracted {len(extracted_text)} chars", selector=self.selector,
+                  status="error" if error_msg else "ok")
+        if error_msg:
             self._shared_state.set("error", error_msg)
-            return error_msg 
\ No newline at end of file
+            return error_msg
+        self._shared_state.set("extracted_content", extracted_text)
+        return f"Successfully extracted content using selector: {self.selector}"
@@ -1,31 +1,272 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, Future
 import requests
+from requests.adapters import HTTPAdapter
 from agency_swarm.tools import BaseTool
+from .validator_store import get_validator_store
+from .step_events import emit_step
 
-# Import Field from Pydantic
+# Import Field from Pydantic (v2 first: BaseTool is a v2 model, so v1 defaults would not apply)
 try:
-    from pydantic.v1 import Field
-except ImportError:
     from pydantic import Field
+except ImportError:
+    from pydantic.v1 import Field
+
+# --- Configuration & Globals ---
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+REQUEST_TIMEOUT = 20 # Seconds per request
+MAX_BATCH_WORKERS = 32 # Max concurrent fetches in a batch sweep
+MAX_PER_HOST = 4 # Max concurrent fetches against a single host
+FETCH_FRESHNESS_SECONDS = float(os.getenv("FETCH_FRESHNESS_SECONDS", 30)) # Reuse a page body fetched this recently (0 = off)
+FETCH_CACHE_MAX_ENTRIES = int(os.getenv("FETCH_CACHE_MAX_ENTRIES", 64)) # Page bodies kept for reuse
+FETCH_CACHE_MAX_BODY_CHARS = 5_000_000 # Larger bodies are shared in flight but not cached
+
+_session = None
+_session_lock = threading.Lock()
+
+# --- Plain Python API (usable without the agency) ---
+def get_session():
+    """Returns the process-wide requests.Session, creating it on first use.
+
+    The session keeps pooled keep-alive connections per host, so repeated checks
+    reuse TCP/TLS connections instead of doing a new handshake every time.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.headers.update(DEFAULT_HEADERS)
+                adapter = HTTPAdapter(pool_connections=100, pool_maxsize=MAX_BATCH_WORKERS)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+def fetch_url(url, timeout=REQUEST_TIMEOUT, validators=None):
+    """Fetches a single URL using the shared session.
+
+    If `validators` ({'etag': ..., 'last_modified': ...}) is given, the request is
+    made conditional and a 304 answer is reported as not_modified with no body.
+
+    Returns a dict with keys: url, ok, status_code, html, not_modified, validators,
+    error, elapsed (seconds). Never raises for network errors; they are reported in 'error'.
+    """
+    result = {"url": url, "ok": False, "status_code": None, "html": None, "not_modified": False,
+              "validators": None, "error": None, "elapsed": 0.0}
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    start = time.perf_counter()
+    try:
+        # TODO: Add optional Selenium/Playwright logic here if requests fail or JS is needed
+        response = get_session().get(url, headers=headers, timeout=timeout)
+        result["status_code"] = response.status_code
+        if response.status_code == 304:
+            result["not_modified"] = True
+            result["validators"] = validators
+            result["ok"] = True
+            return result
+        response.raise_for_status()
+        result["html"] = response.text
+        result["validators"] = {"etag": response.headers.get('ETag'),
+                                "last_modified": response.headers.get('Last-Modified')}
+        result["ok"] = True
+    except requests.exceptions.Timeout:
+        result["error"] = f"Error: Request timed out for URL: {url}"
+    except requests.exceptions.RequestException as e:
+        result["error"] = f"Error fetching URL {url}: {e}"
+    finally:
+        result["elapsed"] = time.perf_counter() - start
+    return result
+
+class FetchCoalescer:
+    """Shares page fetches between callers that want the same URL at about the same time.
+
+    Concurrent callers for a URL wait on one in-flight request instead of each
+    sending their own, and a full (200) body stays reusable for `max_age`
+    seconds, so every watcher of a popular page is served by one origin request.
+    Validators are per URL (see ValidatorStore), so callers sending the same
+    validators can share a conditional request too; a cached or in-flight
+    unconditional fetch serves everyone.
+    """
+
+    def __init__(self, max_age=FETCH_FRESHNESS_SECONDS, max_entries=FETCH_CACHE_MAX_ENTRIES):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._in_flight = {} # (url, etag, last_modified) -> Future of a fetch_url() result
+        self._cache = OrderedDict() # url -> (fetched_at, result), least recently used first
+        self.stats = {"origin_fetches": 0, "joined_in_flight": 0, "cache_hits": 0}
+
+    @staticmethod
+    def _key(url, validators):
+        validators = validators or {}
+        return (url, validators.get('etag'), validators.get('last_modified'))
+
+    def _cached(self, url, now):
+        """Returns the fresh cached result for a URL, dropping it if expired (call with the lock held)."""
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        fetched_at, result = entry
+        if now - fetched_at > self.max_age:
+            del self._cache[url]
+            return None
+        self._cache.move_to_end(url)
+        return result
+
+    def _store(self, url, result, now):
+        """Caches a full response (call with the lock held)."""
+        if self.max_age <= 0 or result["not_modified"] or not result["ok"]:
+            return
+        if len(result["html"] or "") > FETCH_CACHE_MAX_BODY_CHARS:
+            return
+        self._cache[url] = (now, result)
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def fetch(self, url, timeout=REQUEST_TIMEOUT, validators=None):
+        """Like fetch_url(), but shared with concurrent and recent callers. Adds a 'shared' key to the result."""
+        key = self._key(url, validators)
+        unconditional_key = self._key(url, None)
+        with self._lock:
+            cached = self._cached(url, time.monotonic())
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return dict(cached, shared=True)
+            # A full fetch in flight serves conditional callers as well
+            future = self._in_flight.get(unconditional_key) or self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.stats["origin_fetches"] += 1
+            else:
+                self.stats["joined_in_flight"] += 1
+
+        if not owner:
+            return dict(future.result(), shared=True)
+
+        result = None
+        try:
+            result = fetch_url(url, timeout=timeout, validators=validators)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                if result is not None:
+                    self._store(url, result, time.monotonic())
+            if result is not None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Fetch of {url} failed unexpectedly."))
+        return dict(result, shared=False)
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+def get_fetch_coalescer():
+    """Returns the process-wide FetchCoalescer."""
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = FetchCoalescer()
+    return _coalescer
+
+def fetch_shared(url, timeout=REQUEST_TIMEOUT, validators=None):
+    """Fetches a URL through the shared coalescer (see FetchCoalescer). Same result dict as fetch_url(), plus 'shared'."""
+    return get_fetch_coalescer().fetch(url, timeout=timeout, validators=validators)
+
+def fetch_many(urls, max_workers=MAX_BATCH_WORKERS, per_host_limit=MAX_PER_HOST, timeout=REQUEST_TIMEOUT,
+               validator_store=None, selectors=None):
+    """Fetches many URLs concurrently over pooled keep-alive connections.
+
+    At most `max_workers` requests run at once overall and at most `per_host_limit`
+    against any single host. If a `validator_store` is given, requests for URLs
+    in `selectors` (URL -> CSS selector) are made conditional using the validators
+    stored for that selector. Returns a list of fetch_url() result dicts in the
+    same order as `urls`.
+    """
+    selectors = selectors or {}
+    urls = list(urls)
+    if not urls:
+        return []
+
+    host_limits = {}
+    host_limits_lock = threading.Lock()
+
+    def _host_semaphore(url):
+        host = urlsplit(url).netloc.lower()
+        with host_limits_lock:
+            if host not in host_limits:
+                host_limits[host] = threading.BoundedSemaphore(per_host_limit)
+            return host_limits[host]
+
+    def _fetch_limited(url):
+        with _host_semaphore(url):
+            validators = validator_store.get(url, selectors[url]) if validator_store and url in selectors else None
+            return fetch_shared(url, timeout=timeout, validators=validators)
+
+    sweep_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        results = list(executor.map(_fetch_limited, urls))
+    ok_count = sum(1 for r in results if r["ok"])
+    print(f"Batch fetch: {ok_count}/{len(urls)} URLs fetched in {time.perf_counter() - sweep_start:.2f}s")
+    return results
 
 class FetchContentTool(BaseTool):
     """Fetches HTML content from a URL using the requests library."""
     url: str = Field(..., description="The URL of the website to fetch.")
+    selector: Optional[str] = Field(None, description="The CSS selector you will extract from this page. Lets the fetch be skipped with HTTP 304 if the page has not changed since that selector's last check.")
+    selectors: Optional[Dict[str, str]] = Field(None, description="The regions you will extract, as {region name: CSS selector}, when watching several parts of the page.")
+    force_refresh: bool = Field(False, description="Set to true to always download the full page, ignoring cached ETag/Last-Modified validators.")
 
     def run(self):
         self._shared_state.set("current_url", self.url) # Store URL for other tools
-        print(f"Tool: Fetching {self.url}")
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-            response = requests.get(self.url, headers=headers, timeout=20)
-            response.raise_for_status()
-            self._shared_state.set("fetched_html", response.text)
-            return f"Successfully fetched content from {self.url}."
-        except requests.exceptions.Timeout:
-             error_msg = f"Error: Request timed out for URL: {self.url}"
-             self._shared_state.set("error", error_msg)
-             return error_msg
-        except requests.exceptions.RequestException as e:
-            error_msg = f"Error fetching URL {self.url}: {e}"
-            self._shared_state.set("error", error_msg)
-            return error_msg
-        # TODO: Add optional Selenium/Playwright logic here if requests fail or JS is needed 
\ No newline at end of file
+        # Clear state left over from a previous check
+        self._shared_state.set("error", None)
+        self._shared_state.set("fetched_html", None)
+        self._shared_state.set("current_selector", None)
+        self._shared_state.set("extracted_content", None)
+        self._shared_state.set("current_regions", None)
+        self._shared_state.set("extracted_regions", None)
+        self._shared_state.set("region_errors", None)
+        self._shared_state.set("change_detected", False)
+        self._shared_state.set("not_modified", False)
+        self._shared_state.set("pending_validators", None)
+        self._shared_state.set("conditional_selectors", None)
+        emit_step("FetchContentTool", f"Fetching {self.url}", url=self.url)
+
+        # Validators belong to the baseline of a URL + selector; without a selector the full page is fetched
+        selectors = list(self.selectors.values()) if self.selectors else [self.selector] if self.selector else []
+        validators = None if self.force_refresh or not selectors else get_validator_store().get(self.url, selectors)
+        result = fetch_shared(self.url, validators=validators)
+        if not result["ok"]:
+            emit_step("FetchContentTool", f"Fetch failed: {result['error']}", url=self.url, status="error",
+                      elapsed=result["elapsed"])
+            self._shared_state.set("error", result["error"])
+            return result["error"]
+        if result["not_modified"]:
+            emit_step("FetchContentTool", "Not modified since the last check (HTTP 304)", url=self.url,
+                      status="not_modified", elapsed=result["elapsed"])
+            # 304: extraction and comparison can be skipped entirely
+            self._shared_state.set("not_modified", True)
+            self._shared_state.set("conditional_selectors", selectors)
+            return f"Content at {self.url} has not been modified since the last check (HTTP 304)."
+
+        emit_step("FetchContentTool", f"Fetched {len(result['html'])} chars", url=self.url, status="ok",
+                  elapsed=result["elapsed"], shared=result.get("shared", False))
+        self._shared_state.set("fetched_html", result["html"])
+        # Validators are only committed by CompareAndPersistTool once the content is stored
+        self._shared_state.set("pending_validators", result["validators"])
+        return f"Successfully fetched content from {self.url}."
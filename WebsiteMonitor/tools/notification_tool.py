@@ -1,4 +1,5 @@
 from agency_swarm.tools import BaseTool
+from .step_events import emit_step
 
 # Import Field from Pydantic
 try:
@@ -6,23 +7,35 @@ try:
 except ImportError:
     from pydantic import Field
 
+# --- Plain Python API (usable without the agency) ---
+def send_notification(url, new_snippet, diff_text=None):
+    """Builds the change alert for a URL, sends it (prints to console) and returns it.
+
+    The alert shows the diff when there is one, and the start of the new content otherwise (first check).
+    """
+    message = f"Content change detected for: {url}\n"
+    if diff_text:
+        message += f"Changes:\n{diff_text}\n"
+    else:
+        message += f"New Snippet: {new_snippet}...\n"
+    message += "(Full content updated in storage.)"
+
+    print("\n--- ALERT --- ALERT --- ALERT ---")
+    print(message)
+    print("--- END ALERT ---\n")
+    return message
+
 class NotificationTool(BaseTool):
     """Sends a notification if a change was detected."""
     # No input fields needed, uses shared state
 
     def run(self):
-        print("Tool: Checking for notification...")
         if self._shared_state.get("change_detected"):
             url = self._shared_state.get("current_url", "Unknown URL")
             new_snippet = self._shared_state.get("new_content_snippet", "N/A")
-
-            message = f"Content change detected for: {url}\n"
-            message += f"New Snippet: {new_snippet}...\n"
-            message += "(Full content updated in storage.)"
-
-            print("\n--- ALERT --- ALERT --- ALERT ---")
-            print(message)
-            print("--- END ALERT ---\n")
-            return message
+            notification = send_notification(url, new_snippet, self._shared_state.get("diff_text"))
+            emit_step("NotificationTool", f"Notification sent for {url}", url=url, status="sent")
+            return notification
         else:
-            return "No change detected, no notification sent." 
\ No newline at end of file
+            emit_step("NotificationTool", "No change detected, no notification sent.", status="skipped")
+            return "No change detected, no notification sent."
@@ -0,0 +1,39 @@
+# WebsiteMonitor/tools/step_events.py
+"""Structured step events.
+
+Tools (and the agency driving them) report what they are doing with
+emit_step(). Whoever runs them collects the steps of its own run with
+collect_steps(sink): the sink lives in a context variable, so concurrent
+chat turns each get their own steps, and nobody has to redirect stdout.
+Every step is also printed to the console, as before.
+
+A step is a dict: source (tool or agent name), kind ('tool', 'tool_call' or
+'message'), message (one line of human-readable text), time (UNIX
+timestamp), plus any details the emitter adds (url, selector, elapsed, ...).
+"""
+import time
+import contextlib
+import contextvars
+
+_step_sink = contextvars.ContextVar('step_sink', default=None)
+
+def emit_step(source, message, kind="tool", **details):
+    """Reports a step to the active collector (if any) and prints it. Returns the step."""
+    step = {"source": source, "kind": kind, "message": message, "time": time.time(), **details}
+    print(f"{source}: {message}")
+    sink = _step_sink.get()
+    if sink is not None:
+        try:
+            sink(step)
+        except Exception as e: # A broken collector must not break the tool
+            print(f"Error delivering step event: {e}")
+    return step
+
+@contextlib.contextmanager
+def collect_steps(sink):
+    """Sends the steps emitted in this context to sink(step)."""
+    token = _step_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _step_sink.reset(token)
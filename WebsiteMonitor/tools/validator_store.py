@@ -0,0 +1,102 @@
+import os
+import json
+import threading
+
+# --- Configuration & Globals ---
+DATA_DIR = 'data'
+VALIDATOR_STORE_PATH = os.path.join(DATA_DIR, 'validators.json')
+
+def _selector_list(selectors):
+    return [selectors] if isinstance(selectors, str) else list(selectors)
+
+class ValidatorStore:
+    """Persistent, thread-safe store of HTTP cache validators (ETag / Last-Modified) per URL + selector.
+
+    Validators belong to the stored baseline of one URL + selector target: a 304
+    answer to them only means "no change" for targets whose baseline was stored
+    from the response they came with. Another target on the same URL committing
+    newer validators must not make this one's next check a 304.
+
+    Validators are kept in memory and written through to a JSON file next to the
+    stored page content, so conditional requests keep working across restarts.
+    """
+
+    def __init__(self, path=VALIDATOR_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._validators = None # {url: {selector: validators}}, loaded lazily on first access
+
+    def _load(self):
+        if self._validators is not None:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._validators = json.load(f)
+        except FileNotFoundError:
+            self._validators = {}
+        except (ValueError, OSError) as e:
+            print(f"Warning: Could not read validator store {self.path}: {e}. Starting empty.")
+            self._validators = {}
+        # Entries of the old per-URL format can't be attributed to a selector; drop them (one full fetch each)
+        for url in [url for url, entry in self._validators.items() if 'etag' in entry or 'last_modified' in entry]:
+            del self._validators[url]
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._validators, f)
+        os.replace(tmp_path, self.path) # Atomic swap so readers never see a partial file
+
+    def get(self, url, selectors):
+        """Returns {'etag': ..., 'last_modified': ...} to make a conditional request for the URL
+        on behalf of one selector or several, or None if unknown. With several selectors the
+        validators are only returned if all of them were stored with the same ones."""
+        with self._lock:
+            self._load()
+            entry = self._validators.get(url, {})
+            stored = [entry.get(selector) for selector in _selector_list(selectors)]
+        if not stored or stored[0] is None or any(validators != stored[0] for validators in stored[1:]):
+            return None
+        return stored[0]
+
+    def set(self, url, selectors, validators):
+        """Stores validators for the URL and one selector or several. Empty validators remove the entries."""
+        keep = bool(validators and (validators.get('etag') or validators.get('last_modified')))
+        with self._lock:
+            self._load()
+            entry = self._validators.setdefault(url, {})
+            changed = False
+            for selector in _selector_list(selectors):
+                if keep and entry.get(selector) != validators:
+                    entry[selector] = validators
+                    changed = True
+                elif not keep and selector in entry:
+                    del entry[selector]
+                    changed = True
+            if not entry:
+                del self._validators[url]
+            if not changed:
+                return
+            try:
+                self._save()
+            except OSError as e:
+                print(f"Warning: Could not write validator store {self.path}: {e}")
+
+    def forget(self, url, selectors):
+        """Drops the validators for the URL and selector(s), forcing the next fetch to download the full body."""
+        self.set(url, selectors, None)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_validator_store():
+    """Returns the process-wide ValidatorStore."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ValidatorStore()
+    return _store
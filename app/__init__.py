@@ -15,10 +15,12 @@ from config import config # Use the dictionary defined in config.py
 # Assuming Database, Auth, AgencySwarm are siblings to the 'app' directory
 # If they are inside 'app', change the import path
 # Import directly from database_manager again
-from Database.database_manager import init_db, close_db_pool
+from Database.database_manager import init_db, close_connection_pool
 from Auth import create_auth_blueprint
 from AgencySwarm import agency_api_bp # Import the renamed blueprint export
 
+ASGI_WORKER_THREADS = int(os.getenv("ASGI_WORKER_THREADS", 32)) # Flask requests running at once under asgi.py
+
 # Initialize extensions (outside factory to make them accessible)
 login_manager = LoginManager()
 
@@ -76,6 +78,15 @@ def create_app(config_name='default'):
             return "An internal error occurred while loading the page.", 500
 
     # Register shutdown hook
-    atexit.register(close_db_pool)
+    atexit.register(close_connection_pool)
+
+    return app
+
+
+def create_asgi_app(config_name='default'):
+    """ASGI application factory: the Flask app from create_app(), run on a pool of
+    ASGI_WORKER_THREADS threads while the event loop holds the client connections."""
+    # Imported here so the WSGI deployment does not need the ASGI packages
+    from a2wsgi import WSGIMiddleware
 
-    return app 
\ No newline at end of file
+    return WSGIMiddleware(create_app(config_name), workers=ASGI_WORKER_THREADS)
@@ -0,0 +1,16 @@
+# asgi.py
+import os
+from app import create_asgi_app # Import the ASGI factory function
+
+# ASGI entry point: the same Flask app as wsgi.py, served by uvicorn. Run with:
+#   uvicorn asgi:application --host 0.0.0.0 --port $PORT --proxy-headers
+# The WSGI entry point (wsgi.py, gunicorn) keeps working as before.
+
+# Determine the config name from environment variable or default to production
+config_name = os.getenv('FLASK_ENV') or 'production'
+
+if not os.getenv('DATABASE_URL'):
+    print("WARNING: DATABASE_URL environment variable not set in asgi.py.", flush=True)
+
+# Create the application instance using the factory
+application = create_asgi_app(config_name)
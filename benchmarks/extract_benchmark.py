@@ -0,0 +1,115 @@
+# benchmarks/extract_benchmark.py
+"""Measures per-page extraction time of each HTML parser backend on a corpus of saved pages.
+
+Usage:
+    # Save some pages into the corpus first (or copy .html files into benchmarks/pages/)
+    python benchmarks/extract_benchmark.py --save https://example.com/ https://news.ycombinator.com/
+
+    # Run the benchmark with the selector(s) you monitor
+    python benchmarks/extract_benchmark.py --selector "#main" --repeat 5
+
+A per-page selector can be given in <corpus>/selectors.json ({"page.html": "div.price"});
+pages without one use --selector. BeautifulSoup backends are timed twice: with the
+partial (SoupStrainer) parse ExtractContentTool uses, and building the full tree.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from WebsiteMonitor.tools.extract_content_tool import (extract_content, is_backend_available, selector_strainer,
+                                                      PARSER_BACKENDS)
+from WebsiteMonitor.tools.fetch_content_tool import fetch_url
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), 'pages')
+
+def save_pages(urls, corpus_dir):
+    """Fetches URLs and saves their HTML into the corpus."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    for url in urls:
+        result = fetch_url(url)
+        if not result["ok"] or not result["html"]:
+            print(f"  {url}: {result['error']}", file=sys.stderr)
+            continue
+        name = hashlib.md5(url.encode()).hexdigest()[:12] + '.html'
+        with open(os.path.join(corpus_dir, name), 'w', encoding='utf-8') as f:
+            f.write(result["html"])
+        print(f"  saved {url} -> {name} ({len(result['html']) / 1024:.0f} KB)")
+
+def time_extraction(html, selector, backend, partial, repeat):
+    """Median seconds per extraction over `repeat` runs, or None if the backend fails."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _, error = extract_content(html, selector, parser=backend, partial=partial)
+        timings.append(time.perf_counter() - start)
+        if error and 'No elements found' not in error:
+            return None
+    return statistics.median(timings)
+
+def run_benchmark(corpus_dir, default_selector, repeat):
+    selectors = {}
+    selectors_path = os.path.join(corpus_dir, 'selectors.json')
+    if os.path.exists(selectors_path):
+        with open(selectors_path, 'r', encoding='utf-8') as f:
+            selectors = json.load(f)
+    pages = sorted(name for name in os.listdir(corpus_dir) if name.endswith(('.html', '.htm')))
+    if not pages:
+        print(f"No .html pages found in {corpus_dir}. Save some with --save URL ...")
+        return
+
+    columns = []
+    for backend in PARSER_BACKENDS:
+        if not is_backend_available(backend):
+            print(f"Skipping '{backend}' (not installed).")
+            continue
+        if backend in ('html.parser', 'lxml'):
+            columns.append((f"{backend} (partial)", backend, True))
+        columns.append((f"{backend} (full)" if backend in ('html.parser', 'lxml') else backend, backend, False))
+
+    header = f"{'page':<24} {'KB':>6} {'selector':<20} " + ' '.join(f"{label:>20}" for label, _, _ in columns)
+    print(header)
+    print('-' * len(header))
+    totals = {label: [] for label, _, _ in columns}
+    for name in pages:
+        with open(os.path.join(corpus_dir, name), 'r', encoding='utf-8', errors='replace') as f:
+            html = f.read()
+        selector = selectors.get(name, default_selector)
+        cells = []
+        for label, backend, partial in columns:
+            if partial and selector_strainer(selector) is None:
+                cells.append(f"{'(n/a)':>20}") # Selector needs the whole document
+                continue
+            seconds = time_extraction(html, selector, backend, partial, repeat)
+            if seconds is None:
+                cells.append(f"{'error':>20}")
+                continue
+            totals[label].append(seconds)
+            cells.append(f"{seconds * 1000:>17.2f} ms")
+        print(f"{name[:24]:<24} {len(html) / 1024:>6.0f} {selector[:20]:<20} " + ' '.join(cells))
+
+    print('-' * len(header))
+    print(f"{'mean per page':<52} " + ' '.join(
+        f"{statistics.mean(totals[label]) * 1000:>17.2f} ms" if totals[label] else f"{'-':>20}"
+        for label, _, _ in columns))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML parser backends for content extraction.")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Directory of saved .html pages.")
+    parser.add_argument('--selector', default='body', help="CSS selector for pages without an entry in selectors.json.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per page and backend (median is reported).")
+    parser.add_argument('--save', nargs='+', metavar='URL', help="Fetch these URLs into the corpus and exit.")
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save, args.corpus)
+        return
+    run_benchmark(args.corpus, args.selector, args.repeat)
+
+if __name__ == '__main__':
+    main()
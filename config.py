@@ -35,8 +35,13 @@ class Config:
     TESTING = False
 
     # Free Tier Configuration
-    FREE_TIER_TOKEN_LIMIT = int(os.getenv("FREE_TIER_TOKEN_LIMIT", 200))
+    # Turns are billed with the real API usage (typically 2000+ tokens each), so this allows about ten per interval
+    FREE_TIER_TOKEN_LIMIT = int(os.getenv("FREE_TIER_TOKEN_LIMIT", 20000))
     TOKEN_RESET_INTERVAL_MINUTES = int(os.getenv("TOKEN_RESET_INTERVAL_MINUTES", 5))
+    # A free-tier turn reserves its message's tokens plus the typical overhead of a turn when it starts
+    # (settled against the real usage when it ends), so parallel requests see each other's consumption.
+    # This is the overhead assumed until finished turns have been measured.
+    TOKEN_RESERVATION_PER_TURN = int(os.getenv("TOKEN_RESERVATION_PER_TURN", 2000))
 
     # Stripe Configuration
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
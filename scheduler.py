@@ -0,0 +1,28 @@
+# scheduler.py
+import os
+import signal
+
+import config # Loads .env so DATABASE_URL is set before the database module reads it
+from Database.database_manager import init_db
+from MonitorScheduler import MonitorScheduler
+
+# --- Main Entry Point --- (For running with 'python scheduler.py')
+# Runs scheduled website checks as a separate process, independent of the chat app.
+if __name__ == "__main__":
+    print("--- Starting Monitor Scheduler ---")
+    init_db() # Make sure the monitor_targets table exists
+
+    scheduler = MonitorScheduler(
+        max_workers=int(os.getenv("SCHEDULER_MAX_WORKERS", 16)),
+        per_host_interval=float(os.getenv("SCHEDULER_PER_HOST_INTERVAL", 1.0)),
+        jitter_fraction=float(os.getenv("SCHEDULER_JITTER_FRACTION", 0.1)),
+        refresh_interval=int(os.getenv("SCHEDULER_REFRESH_INTERVAL", 60)),
+    )
+
+    def _handle_signal(signum, frame):
+        print(f"Received signal {signum}, stopping scheduler...")
+        scheduler.stop()
+
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    scheduler.run_forever()
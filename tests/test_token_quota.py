@@ -0,0 +1,131 @@
+# tests/test_token_quota.py
+"""Free-tier quota check-and-consume (ChatUnitOfWork.reserve_tokens / settle_tokens) on a SQLite file database."""
+import re
+import sqlite3
+import datetime
+import threading
+
+import pytest
+
+import Database.database_manager as dm
+from config import Config
+
+RESET_INTERVAL = datetime.timedelta(minutes=5)
+
+class _Cursor:
+    """sqlite3 cursor taking the %s placeholders database_manager writes for psycopg2."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(re.sub(r'%s', '?', sql), params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class _Connection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self):
+        return _Cursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """SQLite file with one free-tier user (id 1); every ChatUnitOfWork gets its own connection."""
+    path = str(tmp_path / "quota.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("""CREATE TABLE users (id INTEGER PRIMARY KEY, tokens_used INTEGER DEFAULT 0,
+                        is_subscribed BOOLEAN DEFAULT 0, last_token_reset TIMESTAMP)""")
+        conn.execute("INSERT INTO users (id, tokens_used, last_token_reset) VALUES (1, 0, ?)",
+                     (datetime.datetime.now(datetime.timezone.utc),))
+    monkeypatch.setattr(dm, "IS_POSTGRES", False)
+    monkeypatch.setattr(dm, "get_db_connection", lambda: _Connection(path))
+    monkeypatch.setattr(dm, "release_db_connection", lambda conn: conn.close())
+    return path
+
+def _tokens_used(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT tokens_used FROM users WHERE id = 1").fetchone()[0]
+
+def _reserve(token_limit, reserve):
+    with dm.ChatUnitOfWork() as uow:
+        return uow.reserve_tokens(1, RESET_INTERVAL, token_limit, reserve)
+
+def _settle(details, tokens_used):
+    with dm.ChatUnitOfWork() as uow:
+        uow.settle_tokens(1, details['reserved'], details['reserved_at'], tokens_used)
+
+@pytest.mark.parametrize("token_limit, reserve", [(300, 100), (1000, 100), (500, 250)])
+def test_parallel_reservations_admit_limit_over_reservation(database, token_limit, reserve):
+    requests = 25
+    barrier = threading.Barrier(requests)
+    results = []
+    lock = threading.Lock()
+
+    def request_turn():
+        barrier.wait() # Start all requests at once
+        details = _reserve(token_limit, reserve)
+        with lock:
+            results.append(details)
+
+    threads = [threading.Thread(target=request_turn) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    admitted = [details for details in results if not details['limit_reached']]
+    assert len(results) == requests
+    assert len(admitted) == token_limit // reserve
+    assert all(details['reserved'] == reserve for details in admitted)
+    assert _tokens_used(database) == token_limit
+
+def test_settle_replaces_reservation_with_usage(database):
+    first = _reserve(1000, 100)
+    second = _reserve(1000, 100)
+    assert _tokens_used(database) == 200
+
+    _settle(first, 250)
+    _settle(second, 0) # Failed turn: reservation released
+    assert _tokens_used(database) == 250
+
+def test_settle_after_counter_reset_adds_usage_only(database):
+    before_reset = _reserve(300, 100)
+    with sqlite3.connect(database) as conn: # Reset interval has passed
+        conn.execute("UPDATE users SET last_token_reset = ? WHERE id = 1",
+                     (datetime.datetime.now(datetime.timezone.utc) - 2 * RESET_INTERVAL,))
+
+    after_reset = _reserve(300, 100)
+    assert after_reset['was_reset']
+    assert _tokens_used(database) == 100 # The old reservation went with the reset
+
+    _settle(before_reset, 40) # Its reservation is gone: only the usage counts
+    assert _tokens_used(database) == 140
+    _settle(after_reset, 70)
+    assert _tokens_used(database) == 110
+
+def test_limit_reached_reports_without_consuming(database):
+    assert not _reserve(100, 100)['limit_reached']
+    refused = _reserve(100, 100)
+    assert refused['limit_reached']
+    assert refused['reserved'] == 0
+    assert _tokens_used(database) == 100
+
+def test_default_limits_admit_several_turns(database):
+    turn_usage = Config.TOKEN_RESERVATION_PER_TURN + 50 # A short message plus the assumed overhead
+    admitted = 0
+    while admitted < 100:
+        details = _reserve(Config.FREE_TIER_TOKEN_LIMIT, turn_usage)
+        if details['limit_reached']:
+            break
+        _settle(details, turn_usage)
+        admitted += 1
+
+    assert admitted >= 5
+    assert admitted == -(-Config.FREE_TIER_TOKEN_LIMIT // turn_usage) # Refused once at the limit
+    assert _tokens_used(database) == admitted * turn_usage